@@ -0,0 +1,276 @@
+# bench/backend_check.py
+"""
+儲存後端行為檢查：對每個後端（sqlite / memory）跑同一組情境，
+確認 db.py 的公開函式行為一致，並順便比較整組情境的耗時。
+sqlite 另外跑多程序情境（分片模式：幾個程序共用同一個資料庫檔）。
+任何一個後端有情境失敗就以非 0 結束。
+
+用法：
+    python bench/backend_check.py
+    python bench/backend_check.py --backends memory
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+G = 1
+
+# 多程序情境：兩個程序不停 add_coins，一個程序不停 transfer_coins（先讀餘額再寫入）
+MP_ROUNDS = 500
+MP_GUILDS = {"add": (101, 102), "transfer": 103}
+
+
+async def scenario_settings():
+    assert await db.get_guild_settings(G) == {}
+    await db.upsert_guild_setting(G, welcome_channel_id=5, welcome_message="hi {user}")
+    settings = await db.get_guild_settings(G)
+    assert settings["welcome_channel_id"] == 5 and settings["welcome_message"] == "hi {user}"
+
+
+async def scenario_economy():
+    assert await db.get_coins(G, 1) == 0
+    assert await db.add_coins(G, 1, 500) == 500
+    ok, _ = await db.transfer_coins(G, 1, 2, 100)
+    assert ok and await db.get_coins(G, 1) == 395 and await db.get_coins(G, 2) == 100
+    ok, msg = await db.transfer_coins(G, 3, 2, 100)
+    assert not ok and msg == "金幣不足"
+    can, remain = await db.can_transfer(G, 1)
+    assert not can and remain > 0
+    assert await db.top_coins(G) == [(1, 395), (2, 100)]
+
+    results = await asyncio.gather(*(db.add_coins(G, 10, 1) for _ in range(50)))
+    assert sorted(results) == list(range(1, 51))
+
+
+async def scenario_checkin():
+    assert await db.get_checkin(G, 1) == (0, 0)
+    await db.update_checkin(G, 1, 1000, 3)
+    assert await db.get_checkin(G, 1) == (1000, 3)
+    assert await db.get_streak(G, 1) == 3
+
+
+async def scenario_shop_and_titles():
+    items = [("title_001", "夜貓子", 50, ""), ("title_002", "話匣子", 0, "")]
+    assert await db.seed_shop_catalog([G, G + 1], items) == 2
+    assert await db.seed_shop_catalog([G, G + 1], items) == 0
+    assert [r[0] for r in await db.list_shop(G)] == ["title_002", "title_001"]
+
+    await db.add_coins(G, 5, 60)
+    ok, _, name = await db.buy_item(G, 5, "title_001")
+    assert ok and name == "夜貓子" and await db.get_coins(G, 5) == 10
+    ok, msg, _ = await db.buy_item(G, 5, "title_001")
+    assert not ok and msg == "金幣不足。"
+    ok, msg, _ = await db.buy_item(G, 5, "nope")
+    assert not ok and msg == "找不到這個商品。"
+    assert await db.list_owned_titles(G, 5) == [("title_001", "夜貓子")]
+
+    await db.set_active_title(G, 5, "title_001")
+    assert await db.get_active_title(G, 5) == "夜貓子"
+    await db.set_active_title(G, 5, None)
+    assert await db.get_active_title_item_id(G, 5) is None
+
+
+async def scenario_messages():
+    for uid, n in ((1, 3), (2, 1), (3, 2)):
+        for i in range(n):
+            await db.process_message(G, uid, stats_cooldown=0, xp_cooldown=0, xp_amount=50)
+    assert await db.get_message_count(G, 1) == 3
+    assert (await db.get_user_rank(G, 3))[0] == 2
+    await db.flush_counters()
+    assert await db.top_leaderboard(G) == [(1, 3), (3, 2), (2, 1)]
+    assert await db.get_level(G, 1) == db.xp_to_level(150)
+    profile = await db.get_profile_data(G, 1)
+    assert profile["messages"] == 3 and profile["rank"] == 1 and profile["total"] == 3
+
+
+async def scenario_achievements():
+    await db.add_shop_item(G, "title_009", "成就稱號", 0, "")
+    await db.upsert_achievement(G, "MSG_001", "初次發言", "", "title_009")
+    unlocked, ach = await db.unlock_achievement(G, 7, "MSG_001")
+    assert unlocked and ach[0] == "MSG_001"
+    unlocked, _ = await db.unlock_achievement(G, 7, "MSG_001")
+    assert not unlocked
+    assert await db.has_achievement(G, 7, "MSG_001")
+    assert [r[0] for r in await db.list_inventory(G, 7)] == ["title_009"]
+    assert await db.get_active_title_item_id(G, 7) == "title_009"
+
+
+async def scenario_bulk_grants():
+    await db.add_shop_item(G, "item_010", "活動徽章", 0, "")
+    grants = [(20, "item_010", 2), (21, "item_010", 1), (20, "item_010", 3)]
+    assert await db.grant_inventory_items(G, grants) == 2
+    assert [tuple(r[:2]) for r in await db.list_inventory(G, 20)] == [("item_010", 5)]
+    try:
+        await db.grant_inventory_items(G, [(22, "item_010", 1), (22, "item_010", 0)])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("數量 0 應該被拒絕")
+    assert await db.list_inventory(G, 22) == []
+
+
+async def scenario_airdrop():
+    calls = []
+    chunk_size, db.AIRDROP_CHUNK_SIZE = db.AIRDROP_CHUNK_SIZE, 2
+    try:
+        credited = await db.airdrop_coins(
+            G, 99, [30, 31, 32, 30, 33], 10, role_id=7,
+            progress=lambda done, total: calls.append((done, total)),
+        )
+    finally:
+        db.AIRDROP_CHUNK_SIZE = chunk_size
+    assert credited == 4 and calls == [(2, 4), (4, 4)]
+    assert [await db.get_coins(G, uid) for uid in (30, 31, 32, 33)] == [10] * 4
+    async with db._read() as conn:
+        cur = await conn.execute(
+            "SELECT admin_user_id, role_id, amount, recipients, credited FROM airdrops WHERE guild_id=?;",
+            (G,)
+        )
+        assert [tuple(r) for r in await cur.fetchall()] == [(99, 7, 10, 4, 4)]
+
+
+async def scenario_read_isolation():
+    """寫入交易還沒 commit（最後 rollback）時，讀取不能看到裡面的資料"""
+    await db.add_coins(G, 40, 100)
+    written = asyncio.Event()
+
+    async def failing_write():
+        async with db._write() as conn:
+            await conn.execute("UPDATE wallet SET coins = 0 WHERE guild_id=? AND user_id=?;", (G, 40))
+            written.set()
+            await asyncio.sleep(0.01)
+            raise RuntimeError("rollback")
+
+    task = asyncio.create_task(failing_write())
+    try:
+        await written.wait()
+        assert await db.get_coins(G, 40) == 100
+    finally:
+        try:
+            await task
+        except RuntimeError:
+            pass
+    assert await db.get_coins(G, 40) == 100
+
+
+async def worker(role: str, guild_id: int, path: str) -> int:
+    """多程序情境的子程序：回傳失敗次數（例如 database is locked）"""
+    db.DB_PATH = Path(path)
+    db.configure_storage("sqlite")
+    await db.init_db()
+    failures = 0
+    try:
+        if role == "transfer":
+            await db.add_coins(guild_id, 1, MP_ROUNDS * 2)
+        for _ in range(MP_ROUNDS):
+            try:
+                if role == "add":
+                    await db.add_coins(guild_id, 1, 1)
+                else:
+                    ok, _ = await db.transfer_coins(guild_id, 1, 2, 1)
+                    failures += not ok
+            except sqlite3.Error as e:
+                failures += 1
+                print(f"[worker {role}] {e!r}")
+    finally:
+        await db.close_db()
+    return failures
+
+
+async def scenario_multi_process():
+    """分片模式：幾個程序同時寫同一個檔案，先讀後寫的交易不能因為鎖衝突失敗"""
+    if db._get_storage().name != "sqlite":
+        return  # 其他後端不能跨程序共用
+    path = Path(tempfile.mkdtemp()) / "multi_process.db"
+    # 先把新檔切到 WAL，子程序不必同時切換日誌模式
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.close()
+    jobs = [("add", g) for g in MP_GUILDS["add"]] + [("transfer", MP_GUILDS["transfer"])]
+    procs = [
+        await asyncio.create_subprocess_exec(
+            sys.executable, __file__, "--worker", role, str(guild_id), str(path),
+        )
+        for role, guild_id in jobs
+    ]
+    codes = [await proc.wait() for proc in procs]
+    assert codes == [0] * len(procs), f"子程序失敗次數 {codes}"
+
+    conn = sqlite3.connect(path)
+    try:
+        rows = dict(conn.execute(
+            "SELECT guild_id || ':' || user_id, coins FROM wallet;"
+        ).fetchall())
+        (transfers,) = conn.execute("SELECT COUNT(*) FROM transfers;").fetchone()
+    finally:
+        conn.close()
+    for guild_id in MP_GUILDS["add"]:
+        assert rows[f"{guild_id}:1"] == MP_ROUNDS
+    g = MP_GUILDS["transfer"]
+    # 每次轉 1、手續費 1
+    assert transfers == MP_ROUNDS and rows[f"{g}:2"] == MP_ROUNDS and rows[f"{g}:1"] == 0
+
+
+SCENARIOS = [
+    scenario_settings,
+    scenario_economy,
+    scenario_checkin,
+    scenario_shop_and_titles,
+    scenario_messages,
+    scenario_achievements,
+    scenario_bulk_grants,
+    scenario_airdrop,
+    scenario_read_isolation,
+    scenario_multi_process,
+]
+
+
+async def check(backend: str) -> int:
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "backend_check.db"
+    db.configure_storage(backend)
+    await db.init_db()
+    failures = 0
+    t0 = time.perf_counter()
+    try:
+        for scenario in SCENARIOS:
+            try:
+                await scenario()
+            except Exception:
+                failures += 1
+                print(f"[{backend}] FAIL {scenario.__name__}")
+                traceback.print_exc()
+    finally:
+        await db.close_db()
+    elapsed = (time.perf_counter() - t0) * 1000
+    print(f"[{backend}] {len(SCENARIOS) - failures}/{len(SCENARIOS)} 通過，{elapsed:.1f} ms")
+    return failures
+
+
+async def main(backends: list[str]) -> int:
+    failures = 0
+    for backend in backends:
+        failures += await check(backend)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(db._STORAGE_FACTORIES))
+    # 多程序情境的子程序：--worker <add|transfer> <guild_id> <資料庫路徑>
+    parser.add_argument("--worker", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        role, guild_id, path = args.worker
+        sys.exit(min(asyncio.run(worker(role, int(guild_id), path)), 255))
+    sys.exit(asyncio.run(main(args.backends)))
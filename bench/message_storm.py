@@ -0,0 +1,166 @@
+# bench/message_storm.py
+"""
+訊息風暴效能測試（離線，不連 Discord）：
+用假的 Message 物件直接驅動真正的 Stats.on_message（統計 / XP / 成就），
+以及它發出的 on_message_processed（Economy 的升級公告），
+回報每秒訊息數、單則訊息延遲 p50 / p99，以及每則訊息的 DB 往返次數。
+
+冷卻用模擬時鐘：第 i 則訊息的時間 = 起始時間 + i / --sim-rate 秒，
+讓冷卻、成就門檻等行為和真實流量一致（--sim-rate 0 則使用真實時鐘）。
+
+用法：
+    python bench/message_storm.py
+    python bench/message_storm.py --users 100 1000 10000 --guilds 4 --messages 20000
+    python bench/message_storm.py --backend memory --concurrency 32
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import discord  # noqa: E402
+from discord.ext import commands  # noqa: E402
+
+import db  # noqa: E402
+
+EXTENSIONS = ["cogs.stats", "cogs.economy", "cogs.achievements"]
+
+
+# ===== 假的 Discord 物件（只實作 cog 會用到的屬性）=====
+class FakeChannel:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+
+
+class FakeMember:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.bot = False
+        self.mention = f"<@{user_id}>"
+
+
+class FakeMessage:
+    def __init__(self, guild: FakeGuild, author: FakeMember, channel: FakeChannel):
+        self.guild = guild
+        self.author = author
+        self.channel = channel
+        self.content = "hello"
+
+
+class StormBot(commands.Bot):
+    """記錄每則訊息的處理結果（DB 往返次數）"""
+
+    def __init__(self):
+        super().__init__(command_prefix="!", intents=discord.Intents.default())
+        self.results: list[db.MessageResult] = []
+
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        if event_name == "message_processed":
+            self.results.append(args[1])
+        super().dispatch(event_name, *args, **kwargs)
+
+
+def build_messages(guilds: int, users: int, count: int, seed: int) -> list[FakeMessage]:
+    """依 Zipf 式分布產生訊息：少數人很吵、多數人偶爾發言"""
+    rng = random.Random(seed)
+    channel = FakeChannel()
+    guild_objs = [FakeGuild(g) for g in range(1, guilds + 1)]
+    members = [FakeMember(u) for u in range(1, users + 1)]
+    weights = [1 / (rank ** 1.1) for rank in range(1, users + 1)]
+    authors = rng.choices(members, weights=weights, k=count)
+    return [FakeMessage(rng.choice(guild_objs), author, channel) for author in authors]
+
+
+async def run(backend: str, guilds: int, users: int, count: int, concurrency: int, sim_rate: float) -> dict:
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "bench_storm.db"
+    db.configure_storage(backend)
+    await db.init_db()
+
+    bot = StormBot()
+    # 不登入，只做 Client 的非同步初始化（dispatch 需要 event loop）
+    await bot.__aenter__()
+    for name in EXTENSIONS:
+        await bot.load_extension(name)
+    stats = bot.get_cog("Stats")
+
+    messages = build_messages(guilds, users, count, seed=users)
+    # 成就規則先編譯好，不算進第一則訊息的延遲
+    for g in range(1, guilds + 1):
+        await bot.get_cog("Achievements").rules_for(g)
+
+    real_now = db.utc_now_ts
+    start_ts = real_now()
+    clock = [0]
+    if sim_rate > 0:
+        db.utc_now_ts = lambda: start_ts + int(clock[0] / sim_rate)
+
+    latencies: list[float] = []
+    queue = iter(range(count))
+
+    async def worker():
+        for i in queue:
+            clock[0] = i
+            t0 = time.perf_counter()
+            await stats.on_message(messages[i])
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    try:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        # 等 on_message_processed 等事件處理完
+        while any(t.get_name().startswith("discord.py") for t in asyncio.all_tasks()):
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - t0
+    finally:
+        db.utc_now_ts = real_now
+        await bot.close()
+        await db.close_db()
+
+    latencies.sort()
+    trips = [r.round_trips for r in bot.results]
+    return {
+        "rate": count / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[max(0, int(len(latencies) * 0.99) - 1)],
+        "trips": sum(trips) / len(trips),
+        "db_share": sum(1 for t in trips if t) / len(trips),
+        "levelups": messages[0].channel.sent,
+    }
+
+
+async def main(args):
+    print(f"backend={args.backend} guilds={args.guilds} messages={args.messages} "
+          f"concurrency={args.concurrency} sim-rate={args.sim_rate}/s")
+    print(f"{'users':>8} | {'msg/s':>9} | {'p50 ms':>7} {'p99 ms':>7} | {'DB 往返/則':>10} {'碰 DB 比例':>10} | {'升級公告':>8}")
+    for users in args.users:
+        r = await run(args.backend, args.guilds, users, args.messages, args.concurrency, args.sim_rate)
+        print(f"{users:>8} | {r['rate']:>9.0f} | {r['p50']:>7.3f} {r['p99']:>7.3f} | "
+              f"{r['trips']:>10.3f} {r['db_share']:>10.1%} | {r['levelups']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1_000, 10_000], help="每個伺服器的使用者數")
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=8, help="同時處理訊息的 task 數")
+    parser.add_argument("--sim-rate", type=float, default=50.0, help="模擬時鐘：每秒幾則訊息（0 = 真實時鐘）")
+    parser.add_argument("--backend", default="sqlite", choices=list(db._STORAGE_FACTORIES))
+    asyncio.run(main(parser.parse_args()))
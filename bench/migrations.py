@@ -0,0 +1,185 @@
+# bench/migrations.py
+"""
+Schema 遷移檢查：在暫存資料庫上驗證 db.MIGRATIONS 的升級流程。
+
+  1. 升級：建一個還沒有版本號的舊資料庫（v0：只有基本資料表與資料，user_version=0），
+     跑 init_db()，確認 user_version == SCHEMA_VERSION、各版本的索引 / 資料表都在、舊資料沒掉
+  2. 重跑：再 init_db() 一次不做任何事（版本不變、schema 一模一樣）
+  3. 失敗退回：在最後面接一個會失敗的版本，init_db() 要拋出例外，
+     而且整次升級退回——版本號不變、失敗版本裡已執行的 DDL 也不留下
+
+任何一項不符就以非 0 結束，可以放進部署前的檢查流程。
+
+用法：
+    python bench/migrations.py
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+GUILD_ID = 1
+USER_ID = 1001
+
+# 升級後一定要存在的索引 / 資料表
+EXPECTED_INDEXES = (
+    "idx_user_stats_rank",
+    "idx_wallet_rank",
+    "idx_levels_rank",
+    "idx_transfers_sender",
+    "idx_shop_items_price",
+)
+EXPECTED_TABLES = ("shop_catalog_seeds", "bot_meta", "airdrops")
+# v3 已移除的舊索引
+DROPPED_INDEXES = ("idx_user_stats_guild_count",)
+
+# 失敗版本：第一句成功、第二句語法錯誤
+PROBE_TABLE = "migration_probe"
+BROKEN_MIGRATION = (
+    f"CREATE TABLE {PROBE_TABLE} (x INTEGER);",
+    "CREATE TABLE;",
+)
+
+
+def _make_v0(path: Path):
+    """還沒有 schema 版本的舊資料庫：v1 的資料表加上一些資料，user_version 維持 0"""
+    conn = sqlite3.connect(path)
+    try:
+        for statement in db.MIGRATIONS[0]:
+            conn.execute(statement)
+        conn.execute(
+            "INSERT INTO user_stats (guild_id, user_id, message_count) VALUES (?, ?, ?);",
+            (GUILD_ID, USER_ID, 42),
+        )
+        conn.execute(
+            "INSERT INTO wallet (guild_id, user_id, coins) VALUES (?, ?, ?);",
+            (GUILD_ID, USER_ID, 500),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _inspect(path: Path) -> tuple[int, dict[str, str]]:
+    """(user_version, {物件名稱: 建立語句})"""
+    conn = sqlite3.connect(path)
+    try:
+        (version,) = conn.execute("PRAGMA user_version;").fetchone()
+        objects = dict(conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%';"
+        ).fetchall())
+    finally:
+        conn.close()
+    return version, objects
+
+
+def _check(failures: list[str], ok: bool, message: str):
+    print(f"  {'OK  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+async def _init(path: Path) -> tuple[int, int]:
+    """跑一次 init_db()，回傳這次 _migrate 的 (原版本, 新版本)"""
+    db.DB_PATH = path
+    result: list[tuple[int, int]] = []
+    migrate = db._migrate
+
+    async def recording(conn):
+        result.append(await migrate(conn))
+        return result[-1]
+
+    db._migrate = recording
+    try:
+        await db.init_db()
+    finally:
+        db._migrate = migrate
+        await db.close_db()
+    return result[0]
+
+
+async def check_upgrade(path: Path, failures: list[str]):
+    print("升級 v0 → 最新：")
+    _make_v0(path)
+    old, new = await _init(path)
+    version, objects = _inspect(path)
+    _check(failures, (old, new) == (0, db.SCHEMA_VERSION), f"_migrate 回傳 ({old}, {new})")
+    _check(failures, version == db.SCHEMA_VERSION,
+           f"user_version = {version}（SCHEMA_VERSION = {db.SCHEMA_VERSION}）")
+    for name in EXPECTED_INDEXES + EXPECTED_TABLES:
+        _check(failures, name in objects, f"{name} 存在")
+    for name in DROPPED_INDEXES:
+        _check(failures, name not in objects, f"{name} 已移除")
+
+    conn = sqlite3.connect(path)
+    try:
+        (count,) = conn.execute(
+            "SELECT message_count FROM user_stats WHERE guild_id=? AND user_id=?;",
+            (GUILD_ID, USER_ID),
+        ).fetchone()
+        (coins,) = conn.execute(
+            "SELECT coins FROM wallet WHERE guild_id=? AND user_id=?;",
+            (GUILD_ID, USER_ID),
+        ).fetchone()
+    finally:
+        conn.close()
+    _check(failures, (count, coins) == (42, 500), f"舊資料保留（訊息 {count}、金幣 {coins}）")
+
+
+async def check_rerun(path: Path, failures: list[str]):
+    print("重跑 init_db：")
+    before = _inspect(path)
+    old, new = await _init(path)
+    after = _inspect(path)
+    _check(failures, old == new == db.SCHEMA_VERSION, f"_migrate 回傳 ({old}, {new})")
+    _check(failures, before == after, "版本與 schema 沒有變動")
+
+
+async def check_rollback(path: Path, failures: list[str]):
+    print("失敗的遷移整次退回：")
+    version_before, objects_before = _inspect(path)
+    migrations, schema_version = db.MIGRATIONS, db.SCHEMA_VERSION
+    db.MIGRATIONS = migrations + [BROKEN_MIGRATION]
+    db.SCHEMA_VERSION = len(db.MIGRATIONS)
+    try:
+        await _init(path)
+    except sqlite3.Error as e:
+        _check(failures, True, f"init_db 拋出 {type(e).__name__}: {e}")
+    else:
+        _check(failures, False, "init_db 應該要失敗")
+    finally:
+        db.MIGRATIONS, db.SCHEMA_VERSION = migrations, schema_version
+        await db.close_db()
+
+    version, objects = _inspect(path)
+    _check(failures, version == version_before, f"user_version 維持 {version}")
+    _check(failures, PROBE_TABLE not in objects, f"失敗版本建立的 {PROBE_TABLE} 已退回")
+    _check(failures, objects == objects_before, "其餘 schema 沒有變動")
+
+
+async def main() -> int:
+    failures: list[str] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "migrations.db"
+        await check_upgrade(path, failures)
+        await check_rerun(path, failures)
+        await check_rollback(path, failures)
+    if failures:
+        print(f"{len(failures)} 項檢查失敗")
+        return 1
+    print("遷移檢查全部通過")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    sys.exit(asyncio.run(main()))
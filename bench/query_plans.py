@@ -0,0 +1,194 @@
+# bench/query_plans.py
+"""
+查詢計畫檢查：在灌好資料的暫存資料庫上呼叫 db.py 的每個函式，
+記錄實際執行過的 SQL 與參數，逐條跑 EXPLAIN QUERY PLAN。
+只要有查詢對資料表做全表掃描（SCAN <table>），就列出來並以非 0 結束，
+可以放進部署前的檢查流程，避免改 SQL / 索引後悄悄退化。
+
+用法：
+    python bench/query_plans.py
+    python bench/query_plans.py --verbose   # 印出每條 SQL 的查詢計畫
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+GUILD_ID = 1
+USER_ID = 1001
+OTHER_ID = 1002
+
+# 不需要檢查的語句（DDL / PRAGMA / 交易控制）
+_SKIP = re.compile(r"^\s*(PRAGMA|BEGIN|COMMIT|ROLLBACK|CREATE|DROP)\b", re.IGNORECASE)
+# FROM / JOIN 後面的「資料表 別名」
+_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+_KEYWORDS = {"WHERE", "ON", "LEFT", "JOIN", "INNER", "ORDER", "GROUP", "LIMIT", "USING"}
+
+
+def _record(statements: list[tuple[str, tuple]]):
+    """把 db 的連線包一層，記錄每條 SQL（executemany 只記第一組參數）"""
+    execute = db._TrackedConnection.execute
+    executemany = db._TrackedConnection.executemany
+
+    async def recording_execute(self, sql, params=()):
+        statements.append((sql, tuple(params)))
+        return await execute(self, sql, params)
+
+    async def recording_executemany(self, sql, params):
+        params = list(params)
+        if params:
+            statements.append((sql, tuple(params[0])))
+        return await executemany(self, sql, params)
+
+    db._TrackedConnection.execute = recording_execute
+    db._TrackedConnection.executemany = recording_executemany
+
+
+async def _seed(users: int):
+    async with db._write() as conn:
+        for guild_id in (GUILD_ID, GUILD_ID + 1):
+            uids = range(1, users + 1)
+            await conn.executemany(
+                "INSERT OR IGNORE INTO user_stats (guild_id, user_id, message_count) VALUES (?, ?, ?);",
+                [(guild_id, uid, uid % 97) for uid in uids]
+            )
+            await conn.executemany(
+                "INSERT OR IGNORE INTO wallet (guild_id, user_id, coins) VALUES (?, ?, ?);",
+                [(guild_id, uid, uid % 311) for uid in uids]
+            )
+            await conn.executemany(
+                "INSERT OR IGNORE INTO levels (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?);",
+                [(guild_id, uid, uid % 503, 1 + uid % 7) for uid in uids]
+            )
+            await conn.executemany(
+                "INSERT INTO transfers (guild_id, from_user_id, to_user_id, amount, fee, created_ts) VALUES (?, ?, 1, 10, 1, 0);",
+                [(guild_id, uid) for uid in uids]
+            )
+
+
+def _reset_caches():
+    """清掉記憶體快取，確保每個函式都真的打到資料庫"""
+    db._user_cache.clear()
+    db._rankings.clear()
+    db._top_boards.clear()
+    db._profile_cache.clear()
+    db._shop_catalogs.clear()
+    for tracker in (db._stats_cooldowns, db._xp_cooldowns, db._transfer_cooldowns):
+        tracker._last.clear()
+
+
+async def _exercise():
+    """呼叫每個對外的 db 函式一次"""
+    g, u, v = GUILD_ID, USER_ID, OTHER_ID
+    await db.upsert_guild_setting(g, welcome_channel_id=1)
+    await db.get_guild_settings(g)
+    await db.add_shop_item(g, "title_001", "夜貓子", 10, "")
+    await db.seed_shop_catalog([g, g + 1], [("title_002", "話匣子", 0, "")])
+    await db.seed_shop_catalog([g, g + 1], [("title_002", "話匣子", 0, "")])
+    await db.upsert_achievement(g, "MSG_001", "初次發言", "", "title_001")
+
+    await db.add_coins(g, u, 1000)
+    await db.get_coins(g, u)
+    await db.can_transfer(g, u)
+    await db.transfer_coins(g, u, v, 10)
+    await db.airdrop_coins(g, u, [u, v], 5, role_id=1)
+    await db.buy_item(g, u, "title_001")
+    await db.grant_inventory_item(g, u, "title_001")
+    await db.grant_inventory_items(g, [(u, "title_001", 1), (v, "title_001", 2)])
+    await db.list_shop(g)
+    await db.list_inventory(g, u)
+    await db.list_owned_titles(g, u)
+    await db.set_active_title(g, u, "title_001")
+    await db.get_active_title(g, u)
+    await db.get_active_title_item_id(g, u)
+    await db.set_active_title(g, u, None)
+
+    await db.get_checkin(g, u)
+    await db.update_checkin(g, u, 1, 1)
+    await db.unlock_achievement(g, u, "MSG_001")
+    await db.has_achievement(g, u, "MSG_001")
+    await db.list_achievements(g)
+    await db.list_user_achievements(g, u)
+
+    await db.bump_message_stats(g, u)
+    await db.add_xp(g, u, 15)
+    await db.process_message(g, v)
+    await db.flush_counters()
+    _reset_caches()
+
+    await db.get_message_count(g, u)
+    await db.get_level(g, u)
+    await db.get_streak(g, u)
+    await db.get_level_info(g, u)
+    await db.top_leaderboard(g)
+    await db.top_coins(g)
+    await db.top_levels(g)
+    await db.get_user_rank(g, u)
+    await db.get_profile_data(g, u)
+
+
+def _full_scans(conn: sqlite3.Connection, tables: set[str], sql: str, params: tuple) -> tuple[list[str], list[str]]:
+    """回傳 (對實體資料表的全表掃描, 完整查詢計畫)；計畫裡用的是別名，要先對回資料表"""
+    aliases = {t: t for t in tables}
+    for table, alias in _ALIAS.findall(sql):
+        if table in tables and alias.upper() not in _KEYWORDS:
+            aliases[alias] = table
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+    scans = [d for d in plan if (m := re.match(r"SCAN (\w+)", d)) and m.group(1) in aliases]
+    return scans, plan
+
+
+async def main(users: int, verbose: bool) -> int:
+    path = Path(tempfile.mkdtemp()) / "query_plans.db"
+    db.DB_PATH = path
+    statements: list[tuple[str, tuple]] = []
+    await db.init_db()
+    try:
+        await _seed(users)
+        _reset_caches()
+        _record(statements)
+        await _exercise()
+    finally:
+        await db.close_db()
+
+    # 不跑 ANALYZE：灌的資料量小，統計資料會讓規劃器偏好掃小表，跟正式環境不符
+    conn = sqlite3.connect(path)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+
+    failures = 0
+    seen = set()
+    for sql, params in statements:
+        key = " ".join(sql.split())
+        if _SKIP.match(sql) or key in seen:
+            continue
+        seen.add(key)
+        scans, plan = _full_scans(conn, tables, sql, params)
+        if scans:
+            failures += 1
+            print(f"FULL SCAN: {key}")
+            for detail in scans:
+                print(f"    {detail}")
+        elif verbose:
+            print(f"ok: {key}")
+            for detail in plan:
+                print(f"    {detail}")
+
+    print(f"{len(seen)} 條 SQL 檢查完畢，{failures} 條有全表掃描")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2_000, help="每個伺服器灌入的人數")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.users, args.verbose)))
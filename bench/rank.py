@@ -0,0 +1,94 @@
+# bench/rank.py
+"""
+/rank 查詢效能測試：在暫存資料庫灌入不同人數的伺服器，
+比較舊版「整個伺服器讀進 Python 排序」與 db.get_user_rank 的延遲
+（第一次查詢會載入訊息數分布，之後每次都是 O(log n)）。
+
+用法：
+    python bench/rank.py
+    python bench/rank.py --sizes 1000 10000 80000 --queries 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+GUILD_ID = 1
+
+
+async def legacy_rank(guild_id: int, user_id: int):
+    """舊版做法：撈出整個伺服器再逐筆找"""
+    async with db._read() as conn:
+        cur = await conn.execute("""
+            SELECT user_id, message_count
+            FROM user_stats
+            WHERE guild_id=?
+            ORDER BY message_count DESC;
+        """, (guild_id,))
+        rows = await cur.fetchall()
+    for i, (uid, cnt) in enumerate(rows, start=1):
+        if uid == user_id:
+            return i, cnt, len(rows)
+    return None
+
+
+async def seed(size: int):
+    rng = random.Random(size)
+    async with db._write() as conn:
+        await conn.execute("DELETE FROM user_stats WHERE guild_id=?;", (GUILD_ID,))
+        await conn.executemany(
+            "INSERT INTO user_stats (guild_id, user_id, message_count, last_counted_ts) VALUES (?, ?, ?, 0);",
+            [(GUILD_ID, uid, int(rng.paretovariate(1.2) * 10)) for uid in range(1, size + 1)]
+        )
+    # 直接改表，要讓訊息數分布重新載入
+    db._rankings.pop(GUILD_ID, None)
+
+
+async def measure(fn, size: int, queries: int) -> tuple[float, float]:
+    rng = random.Random(0)
+    samples = []
+    for _ in range(queries):
+        uid = rng.randint(1, size)
+        t0 = time.perf_counter()
+        await fn(GUILD_ID, uid)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+async def main(sizes: list[int], queries: int):
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "bench_rank.db"
+    await db.init_db()
+
+    print(f"{'users':>8} | {'legacy p50':>10} {'p99':>8} | {'indexed p50':>11} {'p99':>8}  (ms)")
+    for size in sizes:
+        await seed(size)
+        # 兩種做法結果要一致（名次以「比自己多的人數 + 1」計）
+        for uid in (1, size // 2, size):
+            new = await db.get_user_rank(GUILD_ID, uid)
+            old = await legacy_rank(GUILD_ID, uid)
+            assert new[1:] == old[1:], (new, old)
+
+        legacy = await measure(legacy_rank, size, max(1, queries // 10))
+        indexed = await measure(db.get_user_rank, size, queries)
+        print(f"{size:>8} | {legacy[0]:>10.3f} {legacy[1]:>8.3f} | {indexed[0]:>11.3f} {indexed[1]:>8.3f}")
+
+    await db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 80_000, 200_000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.queries))
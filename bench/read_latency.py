@@ -0,0 +1,126 @@
+# bench/read_latency.py
+"""
+寫入風暴下的讀取延遲：背景持續送出訊息計數、金幣異動與緩衝寫回，
+同時量測排行榜 / 背包 / 成就查詢的延遲，
+比較「讀寫共用一條連線」（READ_POOL_SIZE=0）與唯讀連線池的差異。
+排行榜量測前會清掉前 K 名快取，量的是真正打到資料庫的查詢；
+top_levels / top_leaderboard 在快取不存在時會先寫回緩衝，尾端延遲包含這次寫回。
+
+用法：
+    python bench/read_latency.py
+    python bench/read_latency.py --users 50000 --seconds 5 --writers 8
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+GUILD_ID = 1
+
+READS = {
+    "top_coins": lambda uid: db.top_coins(GUILD_ID),
+    "top_levels": lambda uid: db.top_levels(GUILD_ID),
+    "top_leaderboard": lambda uid: db.top_leaderboard(GUILD_ID),
+    "list_inventory": lambda uid: db.list_inventory(GUILD_ID, uid),
+    "list_achievements": lambda uid: db.list_achievements(GUILD_ID),
+}
+
+
+async def seed(users: int):
+    async with db._write() as conn:
+        uids = range(1, users + 1)
+        await conn.executemany(
+            "INSERT INTO user_stats (guild_id, user_id, message_count) VALUES (?, ?, ?);",
+            [(GUILD_ID, uid, uid % 997) for uid in uids]
+        )
+        await conn.executemany(
+            "INSERT INTO wallet (guild_id, user_id, coins) VALUES (?, ?, ?);",
+            [(GUILD_ID, uid, uid % 5003) for uid in uids]
+        )
+        await conn.executemany(
+            "INSERT INTO levels (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?);",
+            [(GUILD_ID, uid, uid % 4001, 1 + uid % 9) for uid in uids]
+        )
+        await conn.execute(
+            "INSERT INTO shop_items VALUES (?, 'title_001', '夜貓子', 10, '');", (GUILD_ID,)
+        )
+        await conn.executemany(
+            "INSERT INTO inventory (guild_id, user_id, item_id, qty) VALUES (?, ?, 'title_001', 1);",
+            [(GUILD_ID, uid) for uid in uids]
+        )
+    for code in ("MSG_001", "MSG_100", "LV_005"):
+        await db.upsert_achievement(GUILD_ID, code, code, "", None)
+
+
+async def write_storm(users: int, stop: asyncio.Event, seed_: int):
+    """不斷送出訊息計數（冷卻設 0）、金幣異動，並立刻寫回緩衝"""
+    rng = random.Random(seed_)
+    while not stop.is_set():
+        for _ in range(200):
+            await db.process_message(GUILD_ID, rng.randint(1, users), stats_cooldown=0, xp_cooldown=0)
+        await asyncio.gather(*(db.add_coins(GUILD_ID, rng.randint(1, users), 1) for _ in range(50)))
+        await db.flush_counters()
+
+
+async def measure_reads(users: int, seconds: float) -> dict[str, list[float]]:
+    rng = random.Random(0)
+    samples: dict[str, list[float]] = {name: [] for name in READS}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for name, fn in READS.items():
+            db._top_boards.clear()
+            t0 = time.perf_counter()
+            await fn(rng.randint(1, users))
+            samples[name].append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(0.001)
+    return samples
+
+
+async def run(pool_size: int, users: int, seconds: float, writers: int):
+    db.READ_POOL_SIZE = pool_size
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "bench_read_latency.db"
+    await db.init_db()
+    await seed(users)
+
+    stop = asyncio.Event()
+    storm = [asyncio.create_task(write_storm(users, stop, i)) for i in range(writers)]
+    try:
+        samples = await measure_reads(users, seconds)
+    finally:
+        stop.set()
+        await asyncio.gather(*storm)
+        await db.close_db()
+
+    label = "shared connection" if pool_size <= 0 else f"{pool_size} readers"
+    print(f"--- {label} ---")
+    print(f"{'query':>18} | {'p50':>8} {'p99':>8} {'max':>8}  (ms)")
+    for name, values in samples.items():
+        values.sort()
+        p99 = values[max(0, int(len(values) * 0.99) - 1)]
+        print(f"{name:>18} | {statistics.median(values):>8.3f} {p99:>8.3f} {values[-1]:>8.3f}")
+
+
+async def main(users: int, seconds: float, writers: int, pool_sizes: list[int]):
+    for pool_size in pool_sizes:
+        await run(pool_size, users, seconds, writers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--writers", type=int, default=4, help="同時製造寫入的 task 數")
+    parser.add_argument("--pools", type=int, nargs="+", default=[0, db.READ_POOL_SIZE],
+                        help="要比較的 READ_POOL_SIZE（0 = 讀寫共用連線）")
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.seconds, args.writers, args.pools))
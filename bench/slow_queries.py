@@ -0,0 +1,43 @@
+# bench/slow_queries.py
+"""
+彙總慢查詢日誌（db.py 寫出的 SLOW_QUERY_LOG，含輪替出來的舊檔）：
+依 SQL 分組，列出次數、累計 / 最大耗時、呼叫來源、參數型別與查詢計畫。
+
+用法：
+    python bench/slow_queries.py
+    python bench/slow_queries.py data/slow_queries.log --limit 20
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+from utils.slowlog import read_log, summarize  # noqa: E402
+
+
+def main(args) -> int:
+    entries = read_log(args.path)
+    if not entries:
+        print(f"{args.path}：沒有慢查詢紀錄")
+        return 0
+    print(f"{args.path}：{len(entries)} 筆慢查詢")
+    for i, row in enumerate(summarize(entries, args.limit), 1):
+        avg = row["total_ms"] / row["count"]
+        print(f"\n#{i} {row['count']} 次｜累計 {row['total_ms']:.1f} ms｜平均 {avg:.1f} ms｜最久 {row['max_ms']:.1f} ms")
+        print(f"   來源：{', '.join(row['callers'])}")
+        print(f"   參數：{row['params']}")
+        print(f"   SQL：{row['sql']}")
+        for line in row["plan"]:
+            print(f"     {line}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=db.SLOW_QUERY_LOG)
+    parser.add_argument("--limit", type=int, default=10, help="最多列出幾句 SQL")
+    sys.exit(main(parser.parse_args()))
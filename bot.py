@@ -1,12 +1,66 @@
+from utils.startup import timeline  # 最先 import：啟動時間軸從這裡開始
+
 import os
+import sys
+import asyncio
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-from db import init_db, add_shop_item
+from db import init_db, close_db, seed_shop_catalog
+from utils.command_sync import sync_if_changed
+from utils.metrics import metrics
 load_dotenv()
+timeline.mark("import")
 
 TOKEN = os.getenv("DISCORD_TOKEN")
-GUILD_ID = int(os.getenv("GUILD_ID"))
+# 設定 GUILD_ID：只把指令同步到這個伺服器（開發用，立即生效）
+# 不設定：同步成全域指令，服務 bot 加入的所有伺服器
+GUILD_ID = int(os.getenv("GUILD_ID")) if os.getenv("GUILD_ID") else None
+# 強制同步 slash 指令：python bot.py --force-sync 或 FORCE_SYNC=1
+FORCE_SYNC = "--force-sync" in sys.argv[1:] or os.getenv("FORCE_SYNC", "") not in ("", "0")
+# 啟動時間軸輸出成 JSON 的路徑（不設定就只印出來）
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE")
+# 延遲指標定期寫成 Prometheus 文字檔的路徑（給 node_exporter textfile collector 之類讀取）
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_DUMP_SEC = float(os.getenv("METRICS_DUMP_SEC", "60"))
+
+
+def parse_shard_ids(spec: str | None) -> list[int] | None:
+    """'0-3,8' -> [0, 1, 2, 3, 8]；空字串 / None -> None（由 discord.py 決定）"""
+    if not spec:
+        return None
+    ids = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            ids.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            ids.append(int(part))
+    return sorted(set(ids))
+
+
+# ===== 分片（sharding）=====
+# SHARD_COUNT：總分片數；SHARD_IDS：這個程序負責的分片（例如 "0-3" 或 "0,2"）
+# 兩者都沒設定時維持單一連線的 commands.Bot；設了任一個就改用 AutoShardedBot，
+# 多個程序各自負責一段分片、共用同一個資料庫。
+# 每個伺服器只會落在一個分片（一個程序）上，db.py 的快取都以 guild_id 為 key，不會互相打架。
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+SHARDED = SHARD_COUNT is not None or SHARD_IDS is not None
+if SHARD_IDS is not None and SHARD_COUNT is None:
+    raise SystemExit("設定 SHARD_IDS 時也必須設定 SHARD_COUNT")
+
+# 彼此沒有載入期相依的 extension（只在執行期用 get_cog 互相查找），可以並行載入
+EXTENSIONS = [
+    "cogs.core",
+    "cogs.social",
+    "cogs.stats",
+    "cogs.economy",
+    "cogs.title",
+    "cogs.shop",
+    "cogs.achievements",
+]
 
 # ===== Intents =====
 intents = discord.Intents.default()
@@ -15,48 +69,109 @@ intents.members = True
 intents.messages = True
 intents.message_content = True  # on_message 統計/經驗需要
 
-class XiaoPiYanBot(commands.Bot):
+# ===== 預設商品（稱號）=====
+TITLE_ITEMS = [
+    ("title_001", "夜貓子", 500, "凌晨還在聊天的專屬稱號"),
+    ("title_002", "話匣子", 0, "成就獎勵稱號"),
+    ("title_003", "社群常客", 0, "成就獎勵稱號"),
+    ("title_004", "新手冒險者", 0, "成就獎勵稱號"),
+    ("title_005", "資深玩家", 0, "成就獎勵稱號"),
+    ("title_006", "三日不墜", 0, "成就獎勵稱號"),
+    ("title_007", "打卡達人", 0, "成就獎勵稱號"),
+]
+
+class XiaoPiYanBot(commands.AutoShardedBot if SHARDED else commands.Bot):
+    @property
+    def syncs_commands(self) -> bool:
+        """多個程序共用同一組指令：只讓負責 shard 0 的程序（或未分片時）同步"""
+        return not SHARDED or self.shard_ids is None or 0 in self.shard_ids
+
     async def setup_hook(self):
         # 初始化資料庫
-        await init_db()
-
-        # 載入 cogs（順序無關）
-        await self.load_extension("cogs.core")
-        await self.load_extension("cogs.social")
-        await self.load_extension("cogs.stats")
-        await self.load_extension("cogs.economy")
-        await self.load_extension("cogs.title")
-        await self.load_extension("cogs.shop")
-        await self.load_extension("cogs.achievements")
-        
+        with timeline.phase("init_db"):
+            await init_db()
+
+        # 載入 cogs（順序無關，並行載入）
+        with timeline.phase("load_extensions"):
+            await asyncio.gather(*(self._load_timed(name) for name in EXTENSIONS))
+
         # ===== Slash 指令同步（只在這裡做）=====
-        guild = discord.Object(id=GUILD_ID)
-        self.tree.clear_commands(guild=guild)
-        self.tree.copy_global_to(guild=guild)
-        await self.tree.sync(guild=guild)
-        print("Slash 指令同步完成")
+        # 指令內容沒變就跳過 sync，避免每次重啟都打一次 API
+        with timeline.phase("tree_sync"):
+            if GUILD_ID is not None:
+                guild = discord.Object(id=GUILD_ID)
+                self.tree.clear_commands(guild=guild)
+                self.tree.copy_global_to(guild=guild)
+            else:
+                # 全域指令：所有指令都只在伺服器內使用（資料都以 guild_id 為 key）
+                guild = None
+                for cmd in self.tree.get_commands():
+                    cmd.guild_only = True
+            if not self.syncs_commands:
+                print("Slash 指令由負責 shard 0 的程序同步，這裡略過")
+            elif await sync_if_changed(self.tree, guild=guild, force=FORCE_SYNC):
+                print("Slash 指令同步完成")
+            else:
+                print("Slash 指令未變更，略過同步")
+
+        # 定期寫出延遲指標（/metrics 指令隨時可看，不需要這個）
+        if METRICS_FILE:
+            self._metrics_task = asyncio.create_task(metrics.dump_loop(METRICS_FILE, METRICS_DUMP_SEC))
+
+    async def _load_timed(self, name: str):
+        with timeline.phase(f"load_extension {name}"):
+            await self.load_extension(name)
+
+    async def close(self):
+        task = getattr(self, "_metrics_task", None)
+        if task is not None:
+            task.cancel()
+            # 關閉前再寫一次，最後一段時間的資料不會遺失
+            try:
+                metrics.dump(METRICS_FILE)
+            except OSError as e:
+                print(f"[metrics] 寫出指標失敗：{e!r}")
+        await super().close()
+        # 關閉長駐資料庫連線
+        await close_db()
 
+bot_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if SHARDED else {}
 bot = XiaoPiYanBot(
     command_prefix="!",
-    intents=intents
+    intents=intents,
+    **bot_options
 )
 
+_first_ready = True
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    # 只有 AutoShardedBot 會觸發；第一次啟動時記錄每個分片就緒的時間
+    if _first_ready:
+        timeline.mark(f"shard_ready {shard_id}")
+    print(f"Shard {shard_id} 已就緒")
+
 @bot.event
 async def on_ready():
+    global _first_ready
+    if _first_ready:
+        timeline.mark("first_ready")
     print(f"已登入：{bot.user} ({bot.user.id})")
+    if SHARDED:
+        print(f"分片：{bot.shard_ids or '全部'} / 共 {bot.shard_count}")
     print("我目前加入的伺服器：")
     for g in bot.guilds:
         print(f"- {g.name} ({g.id})")
-    title_items = [
-        ("title_001", "夜貓子", 500, "凌晨還在聊天的專屬稱號"),
-        ("title_002", "話匣子", 0, "成就獎勵稱號"),
-        ("title_003", "社群常客", 0, "成就獎勵稱號"),
-        ("title_004", "新手冒險者", 0, "成就獎勵稱號"),
-        ("title_005", "資深玩家", 0, "成就獎勵稱號"),
-        ("title_006", "三日不墜", 0, "成就獎勵稱號"),
-        ("title_007", "打卡達人", 0, "成就獎勵稱號"),
-    ]
-    for guild in bot.guilds:
-        for item_id, name, price, desc in title_items:
-            await add_shop_item(guild.id, item_id, name, price, desc)
+    # 重新連線也會觸發 on_ready：目錄沒變的伺服器會直接跳過
+    with timeline.phase("seed_catalog"):
+        seeded = await seed_shop_catalog([g.id for g in bot.guilds], TITLE_ITEMS)
+    if seeded:
+        print(f"已寫入預設商品：{seeded} 個伺服器")
+
+    # 只在第一次 ready 時輸出啟動時間軸
+    if _first_ready:
+        _first_ready = False
+        print(timeline.report())
+        if STARTUP_PROFILE:
+            timeline.export(STARTUP_PROFILE)
 bot.run(TOKEN)
@@ -1,3 +1,6 @@
+import asyncio
+from bisect import bisect_right
+
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -11,82 +14,140 @@ from db import (
     get_message_count,
     get_level,
     get_streak,
-    set_active_title,
 )
 
 # 你可以在這裡定義成就規格（code 必須唯一）
+# 規則是宣告式的：metric 達到 threshold 就解鎖
+# metric：messages = 累積發言、level = 等級、streak = 連續簽到
 DEFAULT_ACHIEVEMENTS = [
     # 發言
-    ("MSG_001", "初次發言", "累積發言 1 次", None),
-    ("MSG_100", "話匣子", "累積發言 100 次", "title_002"),
-    ("MSG_500", "社群常客", "累積發言 500 次", "title_003"),
+    ("MSG_001", "初次發言", "累積發言 1 次", None, "messages", 1),
+    ("MSG_100", "話匣子", "累積發言 100 次", "title_002", "messages", 100),
+    ("MSG_500", "社群常客", "累積發言 500 次", "title_003", "messages", 500),
 
     # 等級
-    ("LV_005", "新手冒險者", "達到等級 5", "title_004"),
-    ("LV_010", "資深玩家", "達到等級 10", "title_005"),
+    ("LV_005", "新手冒險者", "達到等級 5", "title_004", "level", 5),
+    ("LV_010", "資深玩家", "達到等級 10", "title_005", "level", 10),
 
     # 連續簽到
-    ("CK_003", "三日不墜", "連續簽到 3 天", "title_006"),
-    ("CK_007", "打卡達人", "連續簽到 7 天", "title_007"),
+    ("CK_003", "三日不墜", "連續簽到 3 天", "title_006", "streak", 3),
+    ("CK_007", "打卡達人", "連續簽到 7 天", "title_007", "streak", 7),
 ]
 
-# 成就條件判斷（你要加新的成就，就在這裡加規則）
-def _should_unlock(code: str, msg_count: int, level: int, streak: int) -> bool:
-    if code == "MSG_001":
-        return msg_count >= 1
-    if code == "MSG_100":
-        return msg_count >= 100
-    if code == "MSG_500":
-        return msg_count >= 500
+# code -> (metric, threshold)
+_RULES = {code: (metric, threshold) for code, _, _, _, metric, threshold in DEFAULT_ACHIEVEMENTS}
 
-    if code == "LV_005":
-        return level >= 5
-    if code == "LV_010":
-        return level >= 10
 
-    if code == "CK_003":
-        return streak >= 3
-    if code == "CK_007":
-        return streak >= 7
+class RuleIndex:
+    """
+    編譯後的成就規則：每個 metric 一份依門檻排序的清單。
+    數值從 old 變成 new 時，用二分搜尋只取出 old < 門檻 <= new 的成就。
+    """
 
-    return False
+    def __init__(self, achievements):
+        # achievements：資料庫中的成就定義 [(code, name, description, reward_item_id), ...]
+        by_metric: dict[str, list] = {}
+        for ach in achievements:
+            rule = _RULES.get(ach[0])
+            if rule is None:
+                continue
+            metric, threshold = rule
+            by_metric.setdefault(metric, []).append((threshold, tuple(ach)))
+
+        self._thresholds: dict[str, list[int]] = {}
+        self._achs: dict[str, list[tuple]] = {}
+        for metric, entries in by_metric.items():
+            entries.sort(key=lambda e: e[0])
+            self._thresholds[metric] = [t for t, _ in entries]
+            self._achs[metric] = [ach for _, ach in entries]
+
+    def crossed(self, metric: str, old: int, new: int) -> list[tuple]:
+        """這次變動新跨過門檻的成就"""
+        if new <= old or metric not in self._thresholds:
+            return []
+        thresholds = self._thresholds[metric]
+        return self._achs[metric][bisect_right(thresholds, old):bisect_right(thresholds, new)]
+
+    def satisfied(self, metric: str, value: int) -> list[tuple]:
+        """目前數值已達成的所有成就（補發用）"""
+        if metric not in self._thresholds:
+            return []
+        return self._achs[metric][:bisect_right(self._thresholds[metric], value)]
 
 
 class Achievements(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._seeded_guilds: set[int] = set()
+        # 寫入中的伺服器：guild_id -> 寫入 task（同時進來的呼叫都等同一個）
+        self._seeding: dict[int, asyncio.Task] = {}
+        self._indexes: dict[int, RuleIndex] = {}
 
     async def ensure_defaults(self, guild_id: int):
-        # 將預設成就寫入資料庫（可重複執行）
-        for code, name, desc, reward_item_id in DEFAULT_ACHIEVEMENTS:
-            await upsert_achievement(guild_id, code, name, desc, reward_item_id)
-
-    async def check_and_unlock(self, guild_id: int, user_id: int, announce_channel: discord.abc.Messageable | None = None):
-        # 確保預設成就存在
-        await self.ensure_defaults(guild_id)
-
-        msg_count = await get_message_count(guild_id, user_id)
-        level = await get_level(guild_id, user_id)
-        streak = await get_streak(guild_id, user_id)
-
-        achievements = await list_achievements(guild_id)
+        # 將預設成就寫入資料庫（每個伺服器啟動後只寫一次）
+        # 新伺服器一次湧入很多第一則訊息時，只有第一個呼叫會寫，其他的等它寫完
+        if guild_id in self._seeded_guilds:
+            return
+        task = self._seeding.get(guild_id)
+        if task is None:
+            task = asyncio.create_task(self._seed_defaults(guild_id))
+            self._seeding[guild_id] = task
+        # shield：其中一個呼叫端被取消，不會連帶取消其他人在等的寫入
+        await asyncio.shield(task)
+
+    async def _seed_defaults(self, guild_id: int):
+        try:
+            for code, name, desc, reward_item_id, _, _ in DEFAULT_ACHIEVEMENTS:
+                await upsert_achievement(guild_id, code, name, desc, reward_item_id)
+            self._seeded_guilds.add(guild_id)
+        finally:
+            # 失敗就不記成已寫入，下一次呼叫重新寫
+            self._seeding.pop(guild_id, None)
+
+    async def rules_for(self, guild_id: int) -> RuleIndex:
+        """回傳該伺服器編譯好的成就規則（每個伺服器只編譯一次）"""
+        index = self._indexes.get(guild_id)
+        if index is None:
+            await self.ensure_defaults(guild_id)
+            index = RuleIndex(await list_achievements(guild_id))
+            self._indexes[guild_id] = index
+        return index
+
+    async def check_and_unlock(
+        self,
+        guild_id: int,
+        user_id: int,
+        announce_channel: discord.abc.Messageable | None = None,
+        changes: dict[str, tuple[int, int]] | None = None,
+    ):
+        """
+        changes：{metric: (舊值, 新值)}，只檢查這次新跨過門檻的成就；
+        不給就用目前數值把所有規則檢查一次。
+        """
+        index = await self.rules_for(guild_id)
+
+        if changes is not None:
+            candidates = [
+                ach for metric, (old, new) in changes.items()
+                for ach in index.crossed(metric, old, new)
+            ]
+        else:
+            candidates = (
+                index.satisfied("messages", await get_message_count(guild_id, user_id))
+                + index.satisfied("level", await get_level(guild_id, user_id))
+                + index.satisfied("streak", await get_streak(guild_id, user_id))
+            )
 
         unlocked_any = False
-        for code, name, desc, reward_item_id in achievements:
-            if not _should_unlock(code, msg_count, level, streak):
-                continue
-
+        for code, name, desc, reward_item_id in candidates:
             unlocked, ach = await unlock_achievement(guild_id, user_id, code)
             if unlocked and ach:
                 unlocked_any = True
 
                 # ach = (code, name, description, reward_item_id)
+                # 獎勵發放與稱號自動佩戴（title_ 開頭）由 unlock_achievement 在同一個交易完成
                 reward_item_id = ach[3]
 
-                # ✅ 自動佩戴：只對稱號道具生效（title_ 開頭）
-                if reward_item_id and reward_item_id.startswith("title_"):
-                    await set_active_title(guild_id, user_id, reward_item_id)
-
                 # 公告（可選）
                 if announce_channel:
                     embed = discord.Embed(
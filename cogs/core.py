@@ -2,12 +2,21 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 from utils.interaction import auto_defer, reply
+from utils.metrics import metrics
+import db
+
+# /metrics 每一類最多列出幾個序列（依累計耗時排序）
+METRICS_TOP = 12
+# /slowlog 最多列出幾句 SQL
+SLOWLOG_TOP = 5
 
 class Core(commands.Cog):
     """
     Phase 0 / Core
     - /ping
     - /help
+    - /metrics（管理員）
+    - /slowlog（管理員）
     """
 
     def __init__(self, bot: commands.Bot):
@@ -32,7 +41,7 @@ class Core(commands.Cog):
         )
         embed.add_field(
             name="🎮 基礎",
-            value="/ping\n/help",
+            value="/ping\n/help\n/metrics（管理員）\n/slowlog（管理員）",
             inline=False
         )
         embed.add_field(
@@ -54,5 +63,79 @@ class Core(commands.Cog):
 
         await reply(interaction, embed=embed, ephemeral=True)
 
+    @app_commands.command(
+        name="metrics",
+        description="查看指令與資料庫的延遲統計（管理員）"
+    )
+    @app_commands.default_permissions(administrator=True)
+    @auto_defer(ephemeral=True)
+    async def metrics(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            return await reply(
+                interaction,
+                "你需要「管理員」權限才能查看效能指標。",
+                ephemeral=True
+            )
+
+        embed = discord.Embed(
+            title="⏱️ 延遲統計（最近 p50 / p99，毫秒）",
+            color=discord.Color.blurple()
+        )
+        for kind, label in (("command", "指令"), ("db", "資料庫")):
+            rows = metrics.snapshot(kind)[:METRICS_TOP]
+            if not rows:
+                value = "（尚無資料）"
+            else:
+                lines = [f"{'名稱':<22}{'次數':>7}{'p50':>8}{'p99':>8}{'錯誤':>5}"]
+                for name, s in rows:
+                    lines.append(
+                        f"{name[:22]:<22}{s.count:>7}"
+                        f"{s.percentile(0.5) * 1000:>8.2f}{s.percentile(0.99) * 1000:>8.2f}{s.errors:>5}"
+                    )
+                value = "```\n" + "\n".join(lines) + "\n```"
+            embed.add_field(name=label, value=value[:1024], inline=False)
+
+        await reply(interaction, embed=embed, ephemeral=True)
+
+    @app_commands.command(
+        name="slowlog",
+        description="查看最近的慢查詢與查詢計畫（管理員）"
+    )
+    @app_commands.default_permissions(administrator=True)
+    @auto_defer(ephemeral=True)
+    async def slowlog(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            return await reply(
+                interaction,
+                "你需要「管理員」權限才能查看效能指標。",
+                ephemeral=True
+            )
+
+        log = db.slow_queries
+        if not log.enabled:
+            return await reply(interaction, "慢查詢紀錄未啟用（SLOW_QUERY_MS < 0）。", ephemeral=True)
+        rows = log.summary(SLOWLOG_TOP)
+        if not rows:
+            return await reply(
+                interaction,
+                f"最近沒有超過 {log.threshold * 1000:g} ms 的查詢。",
+                ephemeral=True
+            )
+
+        embed = discord.Embed(
+            title=f"🐢 慢查詢（> {log.threshold * 1000:g} ms，依累計耗時）",
+            color=discord.Color.orange()
+        )
+        for row in rows:
+            plan = "\n".join(row["plan"]) or "（無）"
+            value = (
+                f"{row['count']} 次｜最久 {row['max_ms']:.1f} ms｜累計 {row['total_ms']:.1f} ms\n"
+                f"來源：{', '.join(row['callers'])}｜參數：{row['params']}\n"
+                f"```\n{plan}\n```"
+            )
+            embed.add_field(name=row["sql"][:250], value=value[:1024], inline=False)
+
+        await reply(interaction, embed=embed, ephemeral=True)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(Core(bot))
@@ -1,19 +1,20 @@
+import asyncio
 import discord
 from discord import app_commands
 from discord.ext import commands
 from datetime import datetime, timezone
 
-from utils.interaction import auto_defer, reply
+from utils.interaction import auto_defer, reply, report_progress
 
 from db import (
     utc_now_ts,
     get_coins, add_coins,
     get_checkin, update_checkin,
-    get_level_info, add_xp,
+    get_level_info, MessageResult,
     top_coins, top_levels,
     can_transfer, transfer_coins,
-    get_profile_data, get_user_rank,
-    get_active_title,
+    get_profile_data,
+    airdrop_coins,
 )
 
 # ===== 工具 =====
@@ -86,35 +87,13 @@ class Economy(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    # ===== 事件：每則訊息給 XP =====
+    # ===== 事件：訊息流程結果（XP 由 Stats 的訊息流程發放）=====
     @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if not message.guild or message.author.bot:
-            return
-
-        did_gain, xp, lvl, leveled = await add_xp(
-            message.guild.id,
-            message.author.id,
-            amount=15,
-            cooldown_sec=60
-        )
-
-        if did_gain and leveled:
+    async def on_message_processed(self, message: discord.Message, result: MessageResult):
+        if result.xp_gained and result.leveled_up:
             try:
                 await message.channel.send(
-                    f"🎉 {message.author.mention} 升到 **Lv.{lvl}** 了！"
-                )
-            except Exception:
-                pass
-
-        # ===== 成就檢查（發言 / 等級類）=====
-        ach_cog = self.bot.get_cog("Achievements")
-        if ach_cog:
-            try:
-                await ach_cog.check_and_unlock(
-                    message.guild.id,
-                    message.author.id,
-                    announce_channel=None  # None = 不公告頻道，避免洗版
+                    f"🎉 {message.author.mention} 升到 **Lv.{result.level}** 了！"
                 )
             except Exception:
                 pass
@@ -139,6 +118,7 @@ class Economy(commands.Cog):
                 ephemeral=True
             )
 
+        old_streak = streak
         streak = streak + 1 if last_ts > 0 and (now - last_ts) <= 48 * 3600 else 1
         reward = 100 + min(200, (streak - 1) * 20)
 
@@ -152,7 +132,8 @@ class Economy(commands.Cog):
                 await ach_cog.check_and_unlock(
                     interaction.guild_id,
                     interaction.user.id,
-                    announce_channel=interaction.channel  # 想公告就用 channel，不想就 None
+                    announce_channel=interaction.channel,  # 想公告就用 channel，不想就 None
+                    changes={"streak": (old_streak, streak)}
                 )
             except Exception:
                 pass
@@ -171,14 +152,13 @@ class Economy(commands.Cog):
         gid = interaction.guild_id
         uid = interaction.user.id
 
+        # 一次查詢取得所有欄位（短時間內重複查詢直接用快取）
         data = await get_profile_data(gid, uid)
-        rank_info = await get_user_rank(gid, uid)
-        active_title = await get_active_title(gid, uid) or "無"
+        active_title = data["title"] or "無"
 
         rank_text = "未上榜"
-        if rank_info:
-            rank, _, total = rank_info
-            rank_text = f"{rank} / {total}"
+        if data["rank"] is not None:
+            rank_text = f"{data['rank']} / {data['total']}"
 
         embed = discord.Embed(
             title=f"👤 {interaction.user.display_name} 的個人資料",
@@ -233,6 +213,60 @@ class Economy(commands.Cog):
         await reply(interaction, f"💸 {interaction.user.mention} → {member.mention}\n{msg}", ephemeral=False)
 
 
+# ===== Group：/economy（管理員）=====
+economy = app_commands.Group(
+    name="economy",
+    description="經濟系統管理（管理員）",
+    default_permissions=discord.Permissions(manage_guild=True)
+)
+
+@economy.command(name="airdrop", description="發金幣給某個身分組的所有成員（管理員）")
+@app_commands.describe(role="要發放的身分組", amount="每人發放的金幣")
+@auto_defer(ephemeral=True)
+async def airdrop_cmd(
+    interaction: discord.Interaction,
+    role: discord.Role,
+    amount: app_commands.Range[int, 1, 1_000_000]
+):
+    if not interaction.user.guild_permissions.manage_guild:
+        return await reply(
+            interaction,
+            "你需要「管理伺服器」權限才能空投金幣。",
+            ephemeral=True
+        )
+
+    # 大型伺服器的成員不一定都在快取裡：先把成員名單抓完整
+    guild = interaction.guild
+    if not guild.chunked:
+        await guild.chunk()
+    user_ids = [m.id for m in role.members if not m.bot]
+    if not user_ids:
+        return await reply(interaction, f"{role.mention} 沒有可以發放的成員。", ephemeral=True)
+
+    state = [0, len(user_ids)]
+
+    def on_progress(done: int, total: int):
+        state[0], state[1] = done, total
+
+    reporter = asyncio.create_task(report_progress(interaction, state, "空投中"))
+    try:
+        credited = await airdrop_coins(
+            interaction.guild_id,
+            interaction.user.id,
+            user_ids,
+            amount,
+            role_id=role.id,
+            progress=on_progress
+        )
+    finally:
+        reporter.cancel()
+
+    await interaction.edit_original_response(
+        content=f"🪂 已發給 {role.mention} 的 {credited} 位成員每人 `🪙 {amount}`，"
+                f"共 `🪙 {credited * amount}`。"
+    )
+
+
 # ===== setup =====
 async def setup(bot: commands.Bot):
     await bot.add_cog(Economy(bot))
@@ -240,3 +274,5 @@ async def setup(bot: commands.Bot):
     # 安全註冊 group（避免重複）
     if bot.tree.get_command("top") is None:
         bot.tree.add_command(top)
+    if bot.tree.get_command("economy") is None:
+        bot.tree.add_command(economy)
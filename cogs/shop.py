@@ -1,15 +1,22 @@
+import re
+import asyncio
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from utils.interaction import auto_defer, reply
+from utils.interaction import auto_defer, reply, report_progress
 
 from db import (
     list_shop,
     buy_item,
-    list_inventory
+    list_inventory,
+    grant_inventory_items
 )
 
+# 名單檔案大小上限（bytes）
+GRANT_FILE_MAX_BYTES = 1_000_000
+_USER_ID = re.compile(r"\d{15,20}")
+
 shop = app_commands.Group(
     name="shop",
     description="商店系統"
@@ -45,13 +52,12 @@ async def shop_list(interaction: discord.Interaction):
     item_id="商品 ID（例如 title_001）",
     qty="購買數量（預設 1）"
 )
+@auto_defer(ephemeral=True)
 async def shop_buy(
     interaction: discord.Interaction,
     item_id: str,
-    qty: int = 1
+    qty: app_commands.Range[int, 1] = 1
 ):
-    await interaction.response.defer(ephemeral=True)
-
     ok, msg, _ = await buy_item(
         interaction.guild_id,
         interaction.user.id,
@@ -91,6 +97,96 @@ async def inventory(interaction: discord.Interaction):
     await reply(interaction, embed=embed, ephemeral=True)
 
 
+def _parse_grant_file(text: str, item_id: str, qty: int) -> list[tuple[int, str, int]]:
+    """
+    名單檔：每行 user_id[,item_id[,qty]]，省略的欄位用指令參數；
+    空行與 # 開頭的行略過。格式錯誤時丟 ValueError（訊息含行號）。
+    """
+    grants = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = [p.strip() for p in line.split(",")]
+        try:
+            user_id = int(parts[0])
+            row_item = parts[1] if len(parts) > 1 and parts[1] else item_id
+            row_qty = int(parts[2]) if len(parts) > 2 and parts[2] else qty
+        except ValueError:
+            raise ValueError(f"第 {lineno} 行格式錯誤：{line}") from None
+        grants.append((user_id, row_item, row_qty))
+    return grants
+
+
+@shop.command(name="grant", description="批次發放道具給多位成員（管理員）")
+@app_commands.describe(
+    item_id="道具 ID（例如 title_001）",
+    qty="每人發放數量（預設 1）",
+    users="成員：@提及或使用者 ID，可一次貼很多個",
+    role="發給擁有這個身分組的所有成員",
+    file="名單檔：每行 user_id[,item_id[,qty]]"
+)
+@auto_defer(ephemeral=True)
+async def shop_grant(
+    interaction: discord.Interaction,
+    item_id: str,
+    qty: app_commands.Range[int, 1] = 1,
+    users: str | None = None,
+    role: discord.Role | None = None,
+    file: discord.Attachment | None = None
+):
+    if not interaction.user.guild_permissions.manage_guild:
+        return await reply(
+            interaction,
+            "你需要「管理伺服器」權限才能發放道具。",
+            ephemeral=True
+        )
+
+    grants = []
+    if users:
+        grants += [(int(uid), item_id, qty) for uid in _USER_ID.findall(users)]
+    if role is not None:
+        # 大型伺服器的成員不一定都在快取裡：先把成員名單抓完整
+        guild = interaction.guild
+        if not guild.chunked:
+            await guild.chunk()
+        grants += [(m.id, item_id, qty) for m in role.members if not m.bot]
+    if file is not None:
+        if file.size > GRANT_FILE_MAX_BYTES:
+            return await reply(interaction, "名單檔太大了（上限 1 MB）。", ephemeral=True)
+        try:
+            text = (await file.read()).decode("utf-8-sig")
+            grants += _parse_grant_file(text, item_id, qty)
+        except (UnicodeDecodeError, ValueError) as e:
+            return await reply(interaction, f"名單檔讀取失敗：{e}", ephemeral=True)
+    if not grants:
+        return await reply(interaction, "請用 users、role 或 file 指定要發放的成員。", ephemeral=True)
+
+    known = {row[0] for row in await list_shop(interaction.guild_id)}
+    unknown = sorted({g[1] for g in grants} - known)
+    if unknown:
+        return await reply(interaction, f"找不到這些道具：{', '.join(unknown[:10])}", ephemeral=True)
+
+    state = [0, 0]
+
+    def on_progress(done: int, total: int):
+        state[0], state[1] = done, total
+
+    reporter = asyncio.create_task(report_progress(interaction, state, "發放中"))
+    try:
+        applied = await grant_inventory_items(interaction.guild_id, grants, progress=on_progress)
+    except ValueError as e:
+        return await reply(interaction, str(e), ephemeral=True)
+    finally:
+        reporter.cancel()
+
+    # 直接改寫原本的回覆，進度訊息不會留在畫面上
+    recipients = len({g[0] for g in grants})
+    await interaction.edit_original_response(
+        content=f"✅ 已發放 {applied} 筆道具給 {recipients} 位成員。"
+    )
+
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(Shop(bot))
     if bot.tree.get_command("shop") is None:
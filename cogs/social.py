@@ -1,3 +1,10 @@
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from functools import lru_cache
+
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -16,11 +23,34 @@ goodbye = app_commands.Group(
     description="離開訊息相關設定"
 )
 
+# ===== 加入潮（burst mode）=====
+# 視窗內加入人數達到門檻就改成合併歡迎：每個視窗只送一則，最多提及 N 人
+# 預設關閉；設定環境變數 WELCOME_BURST_MODE=1 開啟（setup() 時讀取）
+BURST_WINDOW_SEC = 3.0
+BURST_THRESHOLD = 5
+BURST_MAX_MENTIONS = 20
+
+DEFAULT_WELCOME = "{user} 歡迎加入 {guild}！目前人數：{member_count}"
+DEFAULT_GOODBYE = "{user} 已離開 {guild}。目前人數：{member_count}"
+
 # ===== Helper =====
-def render_template(template: str, member: discord.Member) -> str:
+_TEMPLATE_FIELDS = re.compile(r"\{(user|guild|member_count)\}")
+
+
+@lru_cache(maxsize=1024)
+def compile_template(template: str) -> tuple[tuple[bool, str], ...]:
+    """
+    把模板拆成 (是否為變數, 文字) 片段，同一個模板只解析一次。
+    re.split 搭配擷取群組時，奇數位置就是變數名稱。
+    """
+    parts = _TEMPLATE_FIELDS.split(template)
+    return tuple((i % 2 == 1, part) for i, part in enumerate(parts) if part)
+
+
+def render_template(template: str, member: discord.Member, user: str | None = None) -> str:
     """
     可用變數：
-    {user}           -> @使用者
+    {user}           -> @使用者（合併歡迎時由 user 傳入多位使用者）
     {guild}          -> 伺服器名稱
     {member_count}   -> 目前人數
     """
@@ -28,11 +58,14 @@ def render_template(template: str, member: discord.Member) -> str:
     if member_count is None:
         member_count = len(member.guild.members)
 
-    return (
-        (template or "")
-        .replace("{user}", member.mention)
-        .replace("{guild}", member.guild.name)
-        .replace("{member_count}", str(member_count))
+    values = {
+        "user": user if user is not None else member.mention,
+        "guild": member.guild.name,
+        "member_count": str(member_count),
+    }
+    return "".join(
+        values[text] if is_field else text
+        for is_field, text in compile_template(template or "")
     )
 
 
@@ -42,14 +75,59 @@ class Social(commands.Cog):
     - 進/退場訊息
     - /welcome
     - /goodbye
+    burst_mode=True 時，加入潮期間的歡迎訊息會合併成每個視窗一則
     """
 
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, burst_mode: bool = False):
         self.bot = bot
+        self.burst_mode = burst_mode
+        # guild_id -> 最近一個視窗內的加入時間
+        self._recent_joins: dict[int, deque[float]] = {}
+        # guild_id -> 等待合併歡迎的成員 / 負責送出的 task
+        self._burst_joins: dict[int, list[discord.Member]] = {}
+        self._burst_tasks: dict[int, asyncio.Task] = {}
+
+    def cog_unload(self):
+        for task in self._burst_tasks.values():
+            task.cancel()
 
     # ---------- 事件：成員加入 ----------
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
+        if self.burst_mode and self._in_burst(member.guild.id):
+            self._burst_joins.setdefault(member.guild.id, []).append(member)
+            if member.guild.id not in self._burst_tasks:
+                self._burst_tasks[member.guild.id] = asyncio.create_task(
+                    self._flush_burst(member.guild.id)
+                )
+            return
+        await self._send_welcome([member])
+
+    def _in_burst(self, guild_id: int) -> bool:
+        """記下這次加入，回傳是否處於加入潮（視窗內人數達門檻或已在合併中）"""
+        now = time.monotonic()
+        joins = self._recent_joins.setdefault(guild_id, deque())
+        joins.append(now)
+        while joins and now - joins[0] > BURST_WINDOW_SEC:
+            joins.popleft()
+        return guild_id in self._burst_tasks or len(joins) >= BURST_THRESHOLD
+
+    async def _flush_burst(self, guild_id: int):
+        """每個視窗送出一則合併歡迎，直到視窗內沒有新成員"""
+        try:
+            while self._burst_joins.get(guild_id):
+                await asyncio.sleep(BURST_WINDOW_SEC)
+                members = self._burst_joins.pop(guild_id, [])
+                if members:
+                    try:
+                        await self._send_welcome(members)
+                    except discord.HTTPException as e:
+                        print(f"[social] 合併歡迎送出失敗：{e!r}")
+        finally:
+            self._burst_tasks.pop(guild_id, None)
+
+    async def _send_welcome(self, members: list[discord.Member]):
+        member = members[-1]
         settings = await get_guild_settings(member.guild.id)
         channel_id = settings.get("welcome_channel_id")
         if not channel_id:
@@ -59,10 +137,14 @@ class Social(commands.Cog):
         if not channel:
             return
 
-        template = settings.get("welcome_message") or \
-            "{user} 歡迎加入 {guild}！目前人數：{member_count}"
+        template = settings.get("welcome_message") or DEFAULT_WELCOME
 
-        await channel.send(render_template(template, member))
+        user = None
+        if len(members) > 1:
+            user = "、".join(m.mention for m in members[:BURST_MAX_MENTIONS])
+            if len(members) > BURST_MAX_MENTIONS:
+                user += f" 等 {len(members)} 位新成員"
+        await channel.send(render_template(template, member, user))
 
     # ---------- 事件：成員離開 ----------
     @commands.Cog.listener()
@@ -76,8 +158,7 @@ class Social(commands.Cog):
         if not channel:
             return
 
-        template = settings.get("goodbye_message") or \
-            "{user} 已離開 {guild}。目前人數：{member_count}"
+        template = settings.get("goodbye_message") or DEFAULT_GOODBYE
 
         await channel.send(render_template(template, member))
 
@@ -195,7 +276,8 @@ async def goodbye_message(
 # ===== setup =====
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Social(bot))
+    burst_mode = os.getenv("WELCOME_BURST_MODE", "") not in ("", "0")
+    await bot.add_cog(Social(bot, burst_mode=burst_mode))
 
     # 安全註冊（避免 CommandAlreadyRegistered）
     if bot.tree.get_command("welcome") is None:
@@ -2,12 +2,14 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 from utils.interaction import auto_defer, reply
-from db import bump_message_stats, top_leaderboard, get_user_rank
+from db import process_message, top_leaderboard, get_user_rank
 
 class Stats(commands.Cog):
     """
     Phase 1：訊息統計
     - 自動統計訊息數（含冷卻，避免洗版）
+    - 訊息事件的唯一入口：統計 / XP / 成就一次處理，
+      結果以 on_message_processed 事件交給其他 cog
     - /leaderboard
     - /rank
     """
@@ -15,7 +17,7 @@ class Stats(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    # ===== 事件：訊息統計 =====
+    # ===== 事件：訊息統計 / XP / 成就 =====
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if not message.guild:
@@ -23,12 +25,21 @@ class Stats(commands.Cog):
         if message.author.bot:
             return
 
-        # 30 秒冷卻，避免洗訊息
-        await bump_message_stats(
+        rules = None
+        ach_cog = self.bot.get_cog("Achievements")
+        if ach_cog:
+            rules = await ach_cog.rules_for(message.guild.id)
+
+        # 訊息數 30 秒冷卻、XP 60 秒冷卻，避免洗訊息
+        result = await process_message(
             message.guild.id,
             message.author.id,
-            cooldown_sec=30
+            xp_amount=15,
+            stats_cooldown=30,
+            xp_cooldown=60,
+            rules=rules
         )
+        self.bot.dispatch("message_processed", message, result)
 
     # ===== /leaderboard =====
     @app_commands.command(
@@ -1,22 +1,684 @@
+import os
+import sys
+import json
 import time
+import asyncio
+import hashlib
+import inspect
 import aiosqlite
 
 from pathlib import Path
+from collections import OrderedDict
 from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Protocol
+
+from utils.cache import LoadingCache
+from utils.cooldown import CooldownTracker
+from utils.ranking import CountRanking, TopK
+from utils.storage import Storage, SQLiteStorage, MemoryStorage
+from utils.metrics import metrics
+from utils.slowlog import SlowQueryLog
 
 DB_PATH = Path("data") / "bot.db"
 
+# 儲存後端：DB_BACKEND=sqlite（預設，DB_PATH 上的檔案）或 memory（不落地，測試 / 效能測試用）
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+_STORAGE_FACTORIES = {
+    "sqlite": lambda: SQLiteStorage(lambda: DB_PATH),
+    "memory": MemoryStorage,
+}
+_storage: Storage | None = None
+
+_conn: "_TrackedConnection | None" = None
+_conn_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+# 唯讀連線池：WAL 下讀取看的是最後一次 commit 的快照，不必等寫入連線
+# 0 = 不開讀取連線，讀寫共用同一條連線
+READ_POOL_SIZE = 4
+_readers: list["_TrackedConnection"] = []
+_idle_readers: asyncio.Queue | None = None
+# 後端沒有唯讀連線（例如 memory）：讀取共用寫入連線
+_shared_reads = False
+_readers_lock = asyncio.Lock()
+
+# 慢查詢紀錄：單一 SQL 超過 SLOW_QUERY_MS 毫秒就連同查詢計畫寫進 SLOW_QUERY_LOG（輪替檔）
+# SLOW_QUERY_MS 設成負數即關閉；/slowlog 可即時看彙總
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", str(Path("data") / "slow_queries.log"))
+slow_queries = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_LOG)
+
+# 目前 task 的 DB 往返次數計數器（None = 不計算）
+_round_trips: ContextVar[list[int] | None] = ContextVar("_round_trips", default=None)
+
+# 訊息數 / XP 寫入緩衝：每隔幾秒或累積一定筆數才批次寫回
+FLUSH_INTERVAL_SEC = 5
+FLUSH_MAX_PENDING = 500
+
+# (guild_id, user_id) -> 使用者目前數值（以記憶體為準）
+# 依最近使用排序（LRU），超過 USER_CACHE_MAX 筆就從最久沒用的開始淘汰；
+# 還有增量沒寫回（含寫回中）的使用者不淘汰：他的數值以記憶體為準
+USER_CACHE_MAX = 50_000
+_user_cache: OrderedDict[tuple[int, int], "_UserState"] = OrderedDict()
+# 尚未寫回的增量：(guild_id, user_id) -> [count_delta, last_counted_ts]
+_pending_stats: dict[tuple[int, int], list[int]] = {}
+# 尚未寫回的增量：(guild_id, user_id) -> [xp_delta, level, last_xp_ts]
+_pending_xp: dict[tuple[int, int], list[int]] = {}
+# 已從緩衝取出、還沒 commit 的增量 [(stats, xp), ...]
+_in_flight: list[tuple[dict, dict]] = []
+_flush_task: asyncio.Task | None = None
+# 通知 flush task 結束（不用 cancel：寫回到一半被取消，commit 可能已生效卻又被放回緩衝重寫一次）
+_flush_stop: asyncio.Event | None = None
+
+# 金幣 / 背包 / 簽到 / 稱號等異動交給單一寫入 task：
+# 同一輪送進來的異動合併成一個交易，只付一次 commit（fsync）
+WRITE_BATCH_MAX = 256
+_mutations: asyncio.Queue | None = None
+_writer_task: asyncio.Task | None = None
+
+# 批次發放道具時每次 executemany 的筆數（每批之後回報一次進度）
+GRANT_CHUNK_SIZE = 500
+# 空投金幣每批人數：每批一個短交易，批與批之間讓出寫入鎖
+AIRDROP_CHUNK_SIZE = 2000
+
+# guild_id -> 訊息數分布（/rank 用，第一次查詢時載入，之後隨訊息增量維護）
+_rankings: dict[int, CountRanking] = {}
+_rankings_loading: set[int] = set()
+_ranking_lock = asyncio.Lock()
+
+# 排行榜前 K 名快取：(board, guild_id) -> TopK，分數變動時就地更新
+TOP_CACHE_SIZE = 50
+_TOP_KEYS = {
+    "messages": lambda r: (r[1], -r[0]),      # (user_id, message_count)
+    "coins": lambda r: (r[1], -r[0]),         # (user_id, coins)
+    "levels": lambda r: (r[1], r[2], -r[0]),  # (user_id, level, xp)
+}
+_top_boards: LoadingCache[TopK] = LoadingCache()
+# 分數在寫入緩衝裡的排行榜：board -> (0 = _pending_stats / 1 = _pending_xp, 由記憶體數值組出 row)
+_BUFFERED_BOARDS = {
+    "messages": (0, lambda user_id, s: (user_id, s.message_count)),
+    "levels": (1, lambda user_id, s: (user_id, s.level, s.xp)),
+}
+
+# 伺服器設定快取：guild_id -> 設定 dict，第一次讀取時載入，upsert_guild_setting 時作廢
+_guild_settings: LoadingCache[dict] = LoadingCache()
+
+# 商店目錄快取：guild_id -> (依價格排序的商品列, item_id -> 商品)，
+# 第一次讀取時載入，add_shop_item / seed_shop_catalog 寫入該伺服器時作廢
+_shop_catalogs: LoadingCache[tuple[list[tuple], dict[str, tuple]]] = LoadingCache()
+
+# /profile 快照：(guild_id, user_id) -> (到期時間, 快照)，該使用者有寫入（commit 之後）就作廢
+# 與使用者狀態一樣以 USER_CACHE_MAX 為上限，從最久沒用的開始淘汰（快照隨時可重查，沒有不能淘汰的）
+PROFILE_CACHE_TTL_SEC = 10
+_profile_cache: LoadingCache[tuple[float, dict]] = LoadingCache(max_size=USER_CACHE_MAX)
+
+# 記憶體冷卻表：冷卻中的訊息 / 轉帳不必碰資料庫
+COOLDOWN_TTL_SEC = 300
+COOLDOWN_MAX_ENTRIES = 100_000
+_stats_cooldowns = CooldownTracker(COOLDOWN_TTL_SEC, COOLDOWN_MAX_ENTRIES)
+_xp_cooldowns = CooldownTracker(COOLDOWN_TTL_SEC, COOLDOWN_MAX_ENTRIES)
+_transfer_cooldowns = CooldownTracker(COOLDOWN_TTL_SEC, COOLDOWN_MAX_ENTRIES)
+
 # ===== 時間工具 =====
 def utc_now_ts() -> int:
     return int(datetime.now(timezone.utc).timestamp())
 
-# ===== 初始化 =====
-async def init_db():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
+# ===== 連線管理 =====
+class _TrackedConnection:
+    """
+    包一層 aiosqlite 連線，順便計算每個 task 的 DB 往返次數，
+    並把超過門檻的 SQL 交給 slow_queries。
+    耗時從送出到 SQLite 執行完第一步為止（含排在同一條連線後面的等待），
+    fetchall 的時間不算在內；排序 / 彙總類查詢的成本都在第一步。
+    """
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    @staticmethod
+    def _count():
+        counter = _round_trips.get()
+        if counter is not None:
+            counter[0] += 1
+
+    @staticmethod
+    def _caller() -> str:
+        """呼叫端：堆疊上第一個 db.py 的公開函式（寫入佇列的 tx 會是 add_coins.<locals>.tx）"""
+        frame = sys._getframe(2)
+        fallback = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == __file__:
+                if not code.co_name.startswith("_"):
+                    return code.co_qualname
+                fallback = fallback or code.co_qualname
+            frame = frame.f_back
+        return fallback or "?"
+
+    async def execute(self, sql: str, params: Iterable = ()):
+        self._count()
+        t0 = time.perf_counter()
+        cur = await self._conn.execute(sql, params)
+        elapsed = time.perf_counter() - t0
+        if elapsed >= slow_queries.threshold:
+            await slow_queries.record(self._conn, sql, params, elapsed, self._caller())
+        return cur
+
+    async def executemany(self, sql: str, params: Iterable):
+        self._count()
+        if slow_queries.enabled and not isinstance(params, (list, tuple)):
+            params = list(params)  # 產生器執行後就空了，記錄參數型別前先展開
+        t0 = time.perf_counter()
+        cur = await self._conn.executemany(sql, params)
+        elapsed = time.perf_counter() - t0
+        if elapsed >= slow_queries.threshold:
+            await slow_queries.record(self._conn, sql, params, elapsed, self._caller(), many=True)
+        return cur
+
+    async def commit(self):
+        self._count()
+        t0 = time.perf_counter()
+        await self._conn.commit()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= slow_queries.threshold:
+            await slow_queries.record(self._conn, "COMMIT", (), elapsed, self._caller())
+
+    async def rollback(self):
+        self._count()
+        await self._conn.rollback()
+
+    async def close(self):
+        await self._conn.close()
+
+
+def configure_storage(storage: Storage | str):
+    """
+    指定儲存後端（Storage 物件，或 DB_BACKEND 的名稱）。
+    必須在 init_db() 之前、或 close_db() 之後呼叫；
+    會清掉所有記憶體快取，避免沿用上一個後端的資料。
+    """
+    global _storage
+    if _conn is not None:
+        raise RuntimeError("資料庫連線仍開著，請先 close_db()")
+    if isinstance(storage, str):
+        if storage not in _STORAGE_FACTORIES:
+            raise ValueError(f"未知的 DB_BACKEND：{storage}（可用：{', '.join(_STORAGE_FACTORIES)}）")
+        storage = _STORAGE_FACTORIES[storage]()
+    _storage = storage
+    _clear_caches()
+
+
+def _get_storage() -> Storage:
+    if _storage is None:
+        configure_storage(DB_BACKEND)
+    return _storage
+
+
+def _clear_caches():
+    """清掉所有以資料庫內容為準的記憶體狀態（換後端時用）"""
+    global _stats_cooldowns, _xp_cooldowns, _transfer_cooldowns
+    for cache in (
+        _user_cache, _pending_stats, _pending_xp, _rankings, _top_boards,
+        _profile_cache, _guild_settings, _shop_catalogs,
+    ):
+        cache.clear()
+    _stats_cooldowns = CooldownTracker(COOLDOWN_TTL_SEC, COOLDOWN_MAX_ENTRIES)
+    _xp_cooldowns = CooldownTracker(COOLDOWN_TTL_SEC, COOLDOWN_MAX_ENTRIES)
+    _transfer_cooldowns = CooldownTracker(COOLDOWN_TTL_SEC, COOLDOWN_MAX_ENTRIES)
+
+
+async def _get_conn() -> _TrackedConnection:
+    """取得長駐連線（第一次呼叫時由儲存後端建立）"""
+    global _conn
+    if _conn is not None:
+        return _conn
+    async with _conn_lock:
+        if _conn is None:
+            _conn = _TrackedConnection(await _get_storage().open_writer())
+    return _conn
+
+
+async def _get_readers() -> asyncio.Queue | None:
+    """取得唯讀連線池（第一次呼叫時建立）；不開唯讀連線時回傳 None"""
+    global _idle_readers, _shared_reads
+    if _idle_readers is not None or _shared_reads or READ_POOL_SIZE <= 0:
+        return _idle_readers
+    # 先確定寫入連線已建立：資料庫檔案存在、已切到 WAL
+    await _get_conn()
+    async with _readers_lock:
+        if _idle_readers is None and not _shared_reads:
+            conns = await _get_storage().open_readers(READ_POOL_SIZE)
+            if not conns:
+                _shared_reads = True
+                return None
+            pool = asyncio.Queue()
+            for conn in conns:
+                reader = _TrackedConnection(conn)
+                _readers.append(reader)
+                pool.put_nowait(reader)
+            _idle_readers = pool
+    return _idle_readers
+
+
+@asynccontextmanager
+async def _read():
+    """
+    唯讀查詢：向連線池借一條唯讀連線，不會排在寫入交易後面。
+    沒有連線池（記憶體資料庫、READ_POOL_SIZE=0）時借用寫入連線，
+    這時要拿 _write_lock 排在交易之間，否則會讀到還沒 commit、之後可能 rollback 的資料。
+    """
+    pool = await _get_readers()
+    if pool is None:
+        conn = await _get_conn()
+        async with _write_lock:
+            yield conn
+        return
+    conn = await pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put_nowait(conn)
+
+
+@asynccontextmanager
+async def _write():
+    """
+    寫入交易：同一時間只允許一個寫入者，
+    正常離開時 commit，發生例外時 rollback。
+    """
+    conn = await _get_conn()
+    async with _write_lock:
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+
+
+async def close_db():
+    """寫完佇列與緩衝後關閉所有連線（bot 關閉時呼叫）"""
+    global _conn, _flush_task, _idle_readers, _shared_reads
+    if _flush_task is not None:
+        # 請它停下並等它結束：進行中的寫回會正常 commit，剩下的由下面最後一次 flush_counters() 寫完
+        task, _flush_task = _flush_task, None
+        _flush_stop.set()
+        await task
+    await _stop_writer()
+    if _conn is not None:
+        await flush_counters()
+    async with _readers_lock:
+        readers = list(_readers)
+        _readers.clear()
+        _idle_readers = None
+        _shared_reads = False
+        for reader in readers:
+            await reader.close()
+    async with _conn_lock:
+        if _conn is None:
+            return
+        conn, _conn = _conn, None
+        async with _write_lock:
+            await conn.commit()
+            await conn.close()
+    slow_queries.close()
+
+# ===== 寫入緩衝 =====
+async def flush_counters():
+    """把累積的訊息數 / XP 增量用一個交易寫回資料庫"""
+    if not _pending_stats and not _pending_xp:
+        return
+    stats, xp = _take_pending()
+    committed = False
+    try:
+        async with _write() as db:
+            await _write_pending(db, stats, xp)
+        committed = True
+    finally:
+        _settle_pending(stats, xp, committed)
+
+
+def _take_pending():
+    """取出目前的增量準備寫回；寫回結束（不論成敗）後一定要呼叫 _settle_pending"""
+    global _pending_stats, _pending_xp
+    stats, _pending_stats = _pending_stats, {}
+    xp, _pending_xp = _pending_xp, {}
+    _in_flight.append((stats, xp))
+    return stats, xp
+
+
+def _settle_pending(stats: dict, xp: dict, committed: bool):
+    """寫回結束：成功就不再算寫回中；失敗就把增量放回緩衝，下次再試"""
+    _in_flight[:] = [p for p in _in_flight if p[0] is not stats]
+    if not committed:
+        _restore_pending(stats, xp)
+
+
+async def _write_pending(db, stats: dict, xp: dict):
+    if stats:
+        await db.executemany("""
+            INSERT INTO user_stats (guild_id, user_id, message_count, last_counted_ts)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                last_counted_ts = MAX(last_counted_ts, excluded.last_counted_ts);
+        """, [(g, u, d, ts) for (g, u), (d, ts) in stats.items()])
+    if xp:
+        await db.executemany("""
+            INSERT INTO levels (guild_id, user_id, xp, level, last_xp_ts)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                xp = xp + excluded.xp,
+                level = MAX(level, excluded.level),
+                last_xp_ts = MAX(last_xp_ts, excluded.last_xp_ts);
+        """, [(g, u, d, lvl, ts) for (g, u), (d, lvl, ts) in xp.items()])
+
+
+def _restore_pending(stats: dict, xp: dict):
+    for key, (d, ts) in stats.items():
+        p = _pending_stats.setdefault(key, [0, 0])
+        p[0] += d
+        p[1] = max(p[1], ts)
+    for key, (d, lvl, ts) in xp.items():
+        p = _pending_xp.setdefault(key, [0, 1, 0])
+        p[0] += d
+        p[1] = max(p[1], lvl)
+        p[2] = max(p[2], ts)
+
+
+async def _maybe_flush():
+    if len(_pending_stats) + len(_pending_xp) >= FLUSH_MAX_PENDING:
+        await flush_counters()
+
+
+async def _flush_loop(stop: asyncio.Event):
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), FLUSH_INTERVAL_SEC)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await flush_counters()
+        except Exception as e:
+            print(f"[db] 寫回緩衝失敗：{e!r}")
+
+
+def _start_flush_loop():
+    global _flush_task, _flush_stop
+    if _flush_task is None or _flush_task.done():
+        _flush_stop = asyncio.Event()
+        _flush_task = asyncio.create_task(_flush_loop(_flush_stop))
+
+# ===== 寫入佇列（group commit）=====
+async def _submit(tx, *args):
+    """
+    把一筆異動交給寫入 task，等它所在的交易 commit 後回傳 tx 的結果。
+    tx(db, *args) 在自己的 SAVEPOINT 裡執行：拋出例外只會撤銷這一筆，
+    例外原封不動交回呼叫端，同批其他異動照常 commit。
+    """
+    global _mutations, _writer_task
+    if _writer_task is None or _writer_task.done():
+        _mutations = asyncio.Queue()
+        _writer_task = asyncio.create_task(_writer_loop(_mutations))
+    fut = asyncio.get_running_loop().create_future()
+    _mutations.put_nowait((tx, args, fut))
+    return await fut
+
+
+async def _writer_loop(queue: asyncio.Queue):
+    # 寫入 task 的往返次數不算在第一個送件者頭上
+    _round_trips.set(None)
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            # 讓同一輪事件迴圈中送進來的異動也排進佇列，再一起處理
+            await asyncio.sleep(0)
+            batch = [item]
+            stop = False
+            while len(batch) < WRITE_BATCH_MAX and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                await _run_batch(batch)
+            except Exception as e:
+                print(f"[db] 批次寫入失敗：{e!r}")
+            if stop:
+                return
+    finally:
+        # 被取消時，還在排隊的異動也要讓呼叫端知道
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item is not None and not item[2].done():
+                item[2].cancel()
+
+
+async def _run_batch(batch: list):
+    """
+    一批異動共用一個交易、一次 commit；commit 成功後才回覆各自的結果。
+    先整批直接執行；有任何一筆拋出例外才整批撤銷，改成每筆各自一個 SAVEPOINT 重跑，
+    讓失敗的那筆不會拖累其他人（tx 只碰資料庫，重跑是安全的）。
+    """
+    conn = await _get_conn()
+    async with _write_lock:
+        try:
+            results = await _run_txs(conn, batch, isolate=False)
+            if results is None:
+                await conn.rollback()
+                results = await _run_txs(conn, batch, isolate=True)
+            await conn.commit()
+        except BaseException as e:
+            await conn.rollback()
+            for _, _, fut in batch:
+                if fut.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    fut.cancel()
+                else:
+                    fut.set_exception(e)
+            raise
+
+    for fut, result, exc in results:
+        # 呼叫端已經放棄等待（被取消）就不必回覆
+        if fut.done():
+            continue
+        if exc is None:
+            fut.set_result(result)
+        else:
+            fut.set_exception(exc)
+
+
+async def _run_txs(conn, batch: list, isolate: bool) -> list | None:
+    """執行一批 tx；isolate=False 時遇到例外直接回傳 None（由呼叫端撤銷重跑）"""
+    results = []
+    # IMMEDIATE：一開始就拿寫入鎖（等不到由 busy_timeout 重試）。
+    # 用 deferred BEGIN 時，先讀後寫的 tx（例如 transfer_coins）在其他程序寫過之後
+    # 升級寫入鎖會直接得到 SQLITE_BUSY_SNAPSHOT，busy_timeout 不會重試
+    await conn.execute("BEGIN IMMEDIATE;")
+    for tx, args, fut in batch:
+        if not isolate:
+            try:
+                results.append((fut, await tx(conn, *args), None))
+            except Exception:
+                return None
+            continue
+        await conn.execute("SAVEPOINT mutation;")
+        try:
+            results.append((fut, await tx(conn, *args), None))
+        except Exception as e:
+            await conn.execute("ROLLBACK TO mutation;")
+            results.append((fut, None, e))
+        await conn.execute("RELEASE mutation;")
+    return results
+
+
+async def _stop_writer():
+    """處理完佇列中剩下的異動後結束寫入 task"""
+    global _writer_task, _mutations
+    if _writer_task is not None and not _writer_task.done():
+        _mutations.put_nowait(None)
+        await _writer_task
+    _writer_task = None
+    _mutations = None
+
+
+class _UserState:
+    """單一使用者在訊息流程中會用到的數值"""
+    __slots__ = (
+        "message_count", "last_counted_ts",
+        "xp", "level", "last_xp_ts",
+        "streak", "unlocked", "has_stats_row", "rules_checked",
+    )
+
+    def __init__(self, row):
+        (self.message_count, self.last_counted_ts,
+         self.xp, self.level, self.last_xp_ts,
+         self.streak, codes, self.has_stats_row) = row
+        self.unlocked = set(codes.split(",")) if codes else set()
+        # 是否已用目前數值把所有成就規則完整檢查過（之後只看新跨過的門檻）
+        self.rules_checked = False
+
+
+async def _load_user_state(guild_id, user_id) -> _UserState:
+    """
+    取得使用者狀態；沒有快取時用一次查詢把
+    訊息數、等級、連續簽到與已解鎖成就一起讀出來。
+    """
+    key = (guild_id, user_id)
+    state = _user_cache.get(key)
+    if state is not None:
+        _user_cache.move_to_end(key)
+        return state
+    async with _read() as db:
+        cur = await db.execute("""
+            SELECT COALESCE(s.message_count, 0), COALESCE(s.last_counted_ts, 0),
+                   COALESCE(l.xp, 0), COALESCE(l.level, 1), COALESCE(l.last_xp_ts, 0),
+                   COALESCE(c.streak, 0),
+                   (SELECT group_concat(code) FROM user_achievements
+                    WHERE guild_id=k.guild_id AND user_id=k.user_id),
+                   s.user_id IS NOT NULL
+            FROM (SELECT ? AS guild_id, ? AS user_id) k
+            LEFT JOIN user_stats s ON s.guild_id=k.guild_id AND s.user_id=k.user_id
+            LEFT JOIN levels l ON l.guild_id=k.guild_id AND l.user_id=k.user_id
+            LEFT JOIN checkins c ON c.guild_id=k.guild_id AND c.user_id=k.user_id;
+        """, (guild_id, user_id))
+        row = await cur.fetchone()
+    # setdefault：同一使用者並行載入時只保留第一份
+    state = _user_cache.setdefault(key, _UserState(row))
+    if len(_user_cache) > USER_CACHE_MAX:
+        _evict_user_states(keep=key)
+    now = utc_now_ts()
+    _stats_cooldowns.touch(key, state.last_counted_ts, now)
+    _xp_cooldowns.touch(key, state.last_xp_ts, now)
+    return state
+
+
+def _has_unflushed(key) -> bool:
+    if key in _pending_stats or key in _pending_xp:
+        return True
+    return any(key in stats or key in xp for stats, xp in _in_flight)
+
+
+def _evict_user_states(keep):
+    """從最久沒用的開始淘汰到 USER_CACHE_MAX 筆；有增量沒寫回的、以及剛載入的 keep 跳過"""
+    excess = len(_user_cache) - USER_CACHE_MAX
+    victims = []
+    for key in _user_cache:
+        if len(victims) >= excess:
+            break
+        if key != keep and not _has_unflushed(key):
+            victims.append(key)
+    for key in victims:
+        del _user_cache[key]
+
+
+def _on_cooldown(tracker: CooldownTracker, key, now: int, cooldown_sec: int) -> bool:
+    """只看記憶體冷卻表；不確定時當作不在冷卻中（交給後面的流程判斷）"""
+    return (tracker.remaining(key, now, cooldown_sec) or 0) > 0
+
+# ===== 排行榜 / Profile 快取 =====
+def _invalidate_profile(guild_id: int, user_id: int):
+    _profile_cache.invalidate((guild_id, user_id))
+
+
+def _top_update(board: str, guild_id: int, row: tuple):
+    key = (board, guild_id)
+    _top_boards.touch(key)
+    topk = _top_boards.get(key)
+    if topk is not None:
+        topk.update(row)
+
+
+def _top_invalidate(board: str, guild_id: int):
+    """整批分數變動（例如空投）：直接丟掉快取，下次查詢重新載入"""
+    _top_boards.invalidate((board, guild_id))
 
+
+def _unflushed_users(board: str, guild_id: int) -> set[int]:
+    """這個伺服器在緩衝裡（含寫回中）還有增量的使用者"""
+    which, _ = _BUFFERED_BOARDS[board]
+    buffers = [(_pending_stats, _pending_xp)[which]] + [pair[which] for pair in _in_flight]
+    return {user_id for buf in buffers for (g, user_id) in buf if g == guild_id}
+
+
+async def _cached_top(board: str, guild_id: int, limit: int, sql: str) -> list[tuple]:
+    """
+    先看快取；快取不存在或筆數不夠時才查詢，
+    查詢時多抓到 TOP_CACHE_SIZE 筆建立快取。
+    分數在寫入緩衝裡的排行榜（_BUFFERED_BOARDS）一樣從唯讀連線載入，不等寫入；
+    查詢前後還有增量沒寫回的使用者，再用記憶體中的最新數值蓋上去。
+    """
+    key = (board, guild_id)
+    topk = _top_boards.get(key)
+    if topk is not None:
+        rows = topk.top(limit)
+        if rows is not None:
+            return rows
+
+    size = max(limit, TOP_CACHE_SIZE)
+
+    async def fetch(db) -> list[tuple]:
+        cur = await db.execute(sql, (guild_id, size))
+        return [tuple(int(v) for v in r) for r in await cur.fetchall()]
+
+    async def load() -> TopK:
+        buffered = _BUFFERED_BOARDS.get(board)
+        # 查詢前就在緩衝裡的也要算：查詢期間寫回 commit 的增量，快照裡可能沒有
+        users = _unflushed_users(board, guild_id) if buffered else set()
+        async with _read() as db:
+            rows = await fetch(db)
+        topk = TopK(rows, _TOP_KEYS[board], size)
+        if buffered:
+            users |= _unflushed_users(board, guild_id)
+            for user_id in users:
+                state = _user_cache.get((guild_id, user_id))
+                if state is None:
+                    # 已寫回並被淘汰，拿不到最新數值：這次結果不放進快取
+                    _top_boards.touch(key)
+                    continue
+                topk.update(buffered[1](user_id, state))
+        return topk
+
+    topk = await _top_boards.load(key, load)
+    return topk.top(limit)
+
+# ===== Schema 版本遷移 =====
+# 每個版本一組 DDL，只在 init_db() 依序執行一次；
+# 目前版本記在 PRAGMA user_version，熱路徑不再下任何 DDL。
+# 要改 schema 就在最後面加一個新版本，不要修改已發佈的版本。
+MIGRATIONS: list[tuple[str, ...]] = [
+    # v1：基本資料表（IF NOT EXISTS，舊資料庫升級時可直接套用）
+    (
         # ---------- Guild 設定 ----------
-        await db.execute("""
+        """
         CREATE TABLE IF NOT EXISTS guild_settings (
             guild_id INTEGER PRIMARY KEY,
             welcome_channel_id INTEGER,
@@ -24,10 +686,9 @@ async def init_db():
             goodbye_channel_id INTEGER,
             goodbye_message TEXT
         );
-        """)
-
+        """,
         # ---------- 訊息統計 ----------
-        await db.execute("""
+        """
         CREATE TABLE IF NOT EXISTS user_stats (
             guild_id INTEGER NOT NULL,
             user_id INTEGER NOT NULL,
@@ -35,20 +696,18 @@ async def init_db():
             last_counted_ts INTEGER NOT NULL DEFAULT 0,
             PRIMARY KEY (guild_id, user_id)
         );
-        """)
-
+        """,
         # ---------- 金幣 ----------
-        await db.execute("""
+        """
         CREATE TABLE IF NOT EXISTS wallet (
             guild_id INTEGER NOT NULL,
             user_id INTEGER NOT NULL,
             coins INTEGER NOT NULL DEFAULT 0,
             PRIMARY KEY (guild_id, user_id)
         );
-        """)
-
+        """,
         # ---------- 等級 ----------
-        await db.execute("""
+        """
         CREATE TABLE IF NOT EXISTS levels (
             guild_id INTEGER NOT NULL,
             user_id INTEGER NOT NULL,
@@ -57,10 +716,9 @@ async def init_db():
             last_xp_ts INTEGER NOT NULL DEFAULT 0,
             PRIMARY KEY (guild_id, user_id)
         );
-        """)
-
+        """,
         # ---------- 簽到 ----------
-        await db.execute("""
+        """
         CREATE TABLE IF NOT EXISTS checkins (
             guild_id INTEGER NOT NULL,
             user_id INTEGER NOT NULL,
@@ -68,10 +726,9 @@ async def init_db():
             streak INTEGER NOT NULL DEFAULT 0,
             PRIMARY KEY (guild_id, user_id)
         );
-        """)
-
+        """,
         # ---------- 轉帳 ----------
-        await db.execute("""
+        """
         CREATE TABLE IF NOT EXISTS transfers (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             guild_id INTEGER NOT NULL,
@@ -81,36 +738,167 @@ async def init_db():
             fee INTEGER NOT NULL,
             created_ts INTEGER NOT NULL
         );
-        """)
+        """,
         # ---------- 商店系統 ----------
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS shop_items (
-                guild_id INTEGER,
-                item_id TEXT,
-                name TEXT,
-                price INTEGER,
-                description TEXT,
-                PRIMARY KEY (guild_id, item_id)
-            );
-        """)
-
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS inventory (
-                guild_id INTEGER,
-                user_id INTEGER,
-                item_id TEXT,
-                qty INTEGER DEFAULT 0,
-                PRIMARY KEY (guild_id, user_id, item_id)
-            );
-        """)
+        """
+        CREATE TABLE IF NOT EXISTS shop_items (
+            guild_id INTEGER,
+            item_id TEXT,
+            name TEXT,
+            price INTEGER,
+            description TEXT,
+            PRIMARY KEY (guild_id, item_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS inventory (
+            guild_id INTEGER,
+            user_id INTEGER,
+            item_id TEXT,
+            qty INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, item_id)
+        );
+        """,
+        # ---------- 稱號 ----------
+        """
+        CREATE TABLE IF NOT EXISTS active_titles (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            item_id TEXT NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        """,
+        # ---------- 成就 ----------
+        """
+        CREATE TABLE IF NOT EXISTS achievements (
+            guild_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            reward_item_id TEXT,
+            created_ts INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, code)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            unlocked_ts INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id, code)
+        );
+        """,
+    ),
+    # v2：/rank、/leaderboard 依訊息數排序 / 載入分布
+    (
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_stats_guild_count
+        ON user_stats (guild_id, message_count);
+        """,
+    ),
+    # v3：熱門查詢的複合索引（排序欄位與 ORDER BY 一致，不需額外排序）
+    (
+        # /leaderboard：message_count DESC, user_id ASC；也涵蓋 v2 的用途
+        "DROP INDEX IF EXISTS idx_user_stats_guild_count;",
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_stats_rank
+        ON user_stats (guild_id, message_count DESC, user_id);
+        """,
+        # /top coins
+        """
+        CREATE INDEX IF NOT EXISTS idx_wallet_rank
+        ON wallet (guild_id, coins DESC, user_id);
+        """,
+        # /top levels
+        """
+        CREATE INDEX IF NOT EXISTS idx_levels_rank
+        ON levels (guild_id, level DESC, xp DESC, user_id);
+        """,
+        # /give 冷卻：某人最近一次轉帳
+        """
+        CREATE INDEX IF NOT EXISTS idx_transfers_sender
+        ON transfers (guild_id, from_user_id, created_ts);
+        """,
+        # /shop：依價格列出商品
+        """
+        CREATE INDEX IF NOT EXISTS idx_shop_items_price
+        ON shop_items (guild_id, price);
+        """,
+    ),
+    # v4：記錄每個伺服器已寫入的商品目錄版本（目錄沒變就不必重寫）
+    (
+        """
+        CREATE TABLE IF NOT EXISTS shop_catalog_seeds (
+            guild_id INTEGER PRIMARY KEY,
+            catalog_hash TEXT NOT NULL
+        );
+        """,
+    ),
+    # v5：bot 自己的小型 key/value 狀態（例如上次同步的 slash 指令雜湊）
+    (
+        """
+        CREATE TABLE IF NOT EXISTS bot_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        """,
+    ),
+    # v6：/economy airdrop 稽核紀錄（每次空投一列，credited 隨每批入帳累加）
+    (
+        """
+        CREATE TABLE IF NOT EXISTS airdrops (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            admin_user_id INTEGER NOT NULL,
+            role_id INTEGER,
+            amount INTEGER NOT NULL,
+            recipients INTEGER NOT NULL,
+            credited INTEGER NOT NULL DEFAULT 0,
+            created_ts INTEGER NOT NULL
+        );
+        """,
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def _migrate(db) -> tuple[int, int]:
+    """把 schema 升到最新版本；回傳 (原版本, 新版本)"""
+    cur = await db.execute("PRAGMA user_version;")
+    (version,) = await cur.fetchone()
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"資料庫版本 v{version} 比程式支援的 v{SCHEMA_VERSION} 新")
+    if version == SCHEMA_VERSION:
+        return version, version
+
+    # DDL 預設不會自動開交易：手動 BEGIN，讓整次升級要嘛全部成功、要嘛全部退回。
+    # IMMEDIATE 先拿寫入鎖再重讀版本：多個程序（分片）同時啟動時只有一個會真的升級
+    await db.execute("BEGIN IMMEDIATE;")
+    cur = await db.execute("PRAGMA user_version;")
+    (version,) = await cur.fetchone()
+    if version == SCHEMA_VERSION:
+        return version, version
+    for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            await db.execute(statement)
+        await db.execute(f"PRAGMA user_version={target};")
+    return version, SCHEMA_VERSION
 
-        await db.commit()
+# ===== 初始化 =====
+async def init_db():
+    async with _write() as db:
+        old, new = await _migrate(db)
+    if old != new:
+        print(f"[db] schema 已從 v{old} 升級到 v{new}")
+    _start_flush_loop()
 
 # =====================================================
 # Guild Settings
 # =====================================================
 async def upsert_guild_setting(guild_id: int, **kwargs):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute(
             "INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?);",
             (guild_id,)
@@ -120,16 +908,22 @@ async def upsert_guild_setting(guild_id: int, **kwargs):
                 f"UPDATE guild_settings SET {k}=? WHERE guild_id=?;",
                 (v, guild_id)
             )
-        await db.commit()
+    _guild_settings.invalidate(guild_id)
 
 async def get_guild_settings(guild_id: int) -> dict:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT welcome_channel_id, welcome_message,
-                   goodbye_channel_id, goodbye_message
-            FROM guild_settings WHERE guild_id=?;
-        """, (guild_id,))
-        row = await cur.fetchone()
+    """伺服器設定（進 / 退場訊息），第一次讀取後留在記憶體"""
+    cached = _guild_settings.get(guild_id)
+    if cached is not None:
+        return dict(cached)
+
+    async def load() -> dict:
+        async with _read() as db:
+            cur = await db.execute("""
+                SELECT welcome_channel_id, welcome_message,
+                       goodbye_channel_id, goodbye_message
+                FROM guild_settings WHERE guild_id=?;
+            """, (guild_id,))
+            row = await cur.fetchone()
         if not row:
             return {}
         return {
@@ -139,67 +933,156 @@ async def get_guild_settings(guild_id: int) -> dict:
             "goodbye_message": row[3],
         }
 
+    return dict(await _guild_settings.load(guild_id, load))
+
+# =====================================================
+# Bot 狀態（bot_meta）
+# =====================================================
+async def get_meta(key: str) -> str | None:
+    async with _read() as db:
+        cur = await db.execute("SELECT value FROM bot_meta WHERE key=?;", (key,))
+        row = await cur.fetchone()
+        return row[0] if row else None
+
+
+async def set_meta(key: str, value: str):
+    async with _write() as db:
+        await db.execute("""
+            INSERT INTO bot_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value;
+        """, (key, value))
+
 # =====================================================
 # 訊息統計
 # =====================================================
 async def bump_message_stats(guild_id, user_id, cooldown_sec=30):
     now = utc_now_ts()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO user_stats (guild_id, user_id) VALUES (?, ?);",
-            (guild_id, user_id)
-        )
-        cur = await db.execute(
-            "SELECT last_counted_ts FROM user_stats WHERE guild_id=? AND user_id=?;",
-            (guild_id, user_id)
-        )
-        (last,) = await cur.fetchone()
-        if now - last < cooldown_sec:
-            return False
-
-        await db.execute("""
-            UPDATE user_stats
-            SET message_count = message_count + 1,
-                last_counted_ts = ?
-            WHERE guild_id=? AND user_id=?;
-        """, (now, guild_id, user_id))
-        await db.commit()
-        return True
+    if _on_cooldown(_stats_cooldowns, (guild_id, user_id), now, cooldown_sec):
+        return False
+    state = await _load_user_state(guild_id, user_id)
+    if not _apply_message_count(guild_id, user_id, state, now, cooldown_sec):
+        return False
+    await _maybe_flush()
+    return True
+
+
+def _apply_message_count(guild_id, user_id, state: _UserState, now: int, cooldown_sec: int) -> bool:
+    if now - state.last_counted_ts < cooldown_sec:
+        return False
+    ranking = _rankings.get(guild_id)
+    if ranking is not None:
+        if state.has_stats_row:
+            ranking.move(state.message_count, state.message_count + 1)
+        else:
+            ranking.add(state.message_count + 1)
+    state.has_stats_row = True
+    state.message_count += 1
+    state.last_counted_ts = now
+    _top_update("messages", guild_id, (user_id, state.message_count))
+    _invalidate_profile(guild_id, user_id)
+    _stats_cooldowns.touch((guild_id, user_id), now)
+    pending = _pending_stats.setdefault((guild_id, user_id), [0, 0])
+    pending[0] += 1
+    pending[1] = now
+    return True
 
 async def top_leaderboard(guild_id, limit=10):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT user_id, message_count
-            FROM user_stats
-            WHERE guild_id=?
-            ORDER BY message_count DESC
-            LIMIT ?;
-        """, (guild_id, limit))
-        return await cur.fetchall()
+    return await _cached_top("messages", guild_id, limit, """
+        SELECT user_id, message_count
+        FROM user_stats
+        WHERE guild_id=?
+        ORDER BY message_count DESC, user_id ASC
+        LIMIT ?;
+    """)
 
 async def get_user_rank(guild_id, user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT user_id, message_count
-            FROM user_stats
-            WHERE guild_id=?
-            ORDER BY message_count DESC;
-        """, (guild_id,))
-        rows = await cur.fetchall()
-    for i, (uid, cnt) in enumerate(rows, start=1):
-        if uid == user_id:
-            return i, cnt, len(rows)
-    return None
+    """
+    回傳 (名次, 訊息數, 總人數)；名次 = 訊息數比自己多的人數 + 1。
+    名次由記憶體中的訊息數分布計算（O(log n)），不再把整個伺服器讀進 Python。
+    """
+    ranking = await _guild_ranking(guild_id)
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        if not state.has_stats_row:
+            return None
+        count = state.message_count
+    else:
+        async with _read() as db:
+            cur = await db.execute(
+                "SELECT message_count FROM user_stats WHERE guild_id=? AND user_id=?;",
+                (guild_id, user_id)
+            )
+            row = await cur.fetchone()
+        if not row:
+            return None
+        count = row[0]
+    return ranking.count_above(count) + 1, count, ranking.total
+
+
+async def _guild_ranking(guild_id) -> CountRanking:
+    ranking = _rankings.get(guild_id)
+    if ranking is not None and guild_id not in _rankings_loading:
+        return ranking
+    async with _ranking_lock:
+        ranking = _rankings.get(guild_id)
+        if ranking is None:
+            ranking = await _load_ranking(guild_id)
+    return ranking
+
+
+async def _load_ranking(guild_id) -> CountRanking:
+    """
+    先把緩衝寫回，再用 (guild_id, message_count) 索引載入分布。
+    空的分布在取出緩衝的同時就掛上去，查詢期間的新訊息會直接累加，
+    不會和查詢結果重複或遺漏。
+    """
+    ranking = CountRanking()
+    stats = xp = None
+    committed = False
+    _rankings_loading.add(guild_id)
+    try:
+        async with _write() as db:
+            stats, xp = _take_pending()
+            _rankings[guild_id] = ranking
+            await _write_pending(db, stats, xp)
+            cur = await db.execute("""
+                SELECT message_count, COUNT(*)
+                FROM user_stats
+                WHERE guild_id=?
+                GROUP BY message_count;
+            """, (guild_id,))
+            rows = await cur.fetchall()
+        committed = True
+    except BaseException:
+        _rankings.pop(guild_id, None)
+        raise
+    finally:
+        if stats is not None:
+            _settle_pending(stats, xp, committed)
+        _rankings_loading.discard(guild_id)
+    ranking.load(rows)
+    return ranking
 
 # =====================================================
 # 金幣 / 簽到 / 等級
 # =====================================================
 async def get_coins(guild_id, user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO wallet (guild_id, user_id) VALUES (?, ?);",
+    async with _read() as db:
+        cur = await db.execute(
+            "SELECT coins FROM wallet WHERE guild_id=? AND user_id=?;",
             (guild_id, user_id)
         )
+        row = await cur.fetchone()
+        return row[0] if row else 0
+
+async def add_coins(guild_id, user_id, delta):
+    async def tx(db):
+        await db.execute("""
+            INSERT INTO wallet (guild_id, user_id, coins)
+            VALUES (?, ?, ?)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET coins = coins + excluded.coins;
+        """, (guild_id, user_id, delta))
         cur = await db.execute(
             "SELECT coins FROM wallet WHERE guild_id=? AND user_id=?;",
             (guild_id, user_id)
@@ -207,69 +1090,118 @@ async def get_coins(guild_id, user_id):
         (coins,) = await cur.fetchone()
         return coins
 
-async def add_coins(guild_id, user_id, delta):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO wallet (guild_id, user_id) VALUES (?, ?);",
-            (guild_id, user_id)
-        )
-        await db.execute(
-            "UPDATE wallet SET coins = coins + ? WHERE guild_id=? AND user_id=?;",
-            (delta, guild_id, user_id)
-        )
-        await db.commit()
-        return await get_coins(guild_id, user_id)
+    coins = await _submit(tx)
+    _top_update("coins", guild_id, (user_id, coins))
+    _invalidate_profile(guild_id, user_id)
+    return coins
+
+async def airdrop_coins(
+    guild_id: int,
+    admin_user_id: int,
+    user_ids: Iterable[int],
+    amount: int,
+    role_id: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """
+    空投金幣：user_ids 每人加 amount（重複的 ID 只算一次）。
+    每 AIRDROP_CHUNK_SIZE 人一個短交易（executemany UPSERT），批與批之間讓出寫入鎖與 event loop，
+    訊息流程的寫回與其他寫入可以插隊，不會被一整個大交易卡住。
+    稽核只寫一列 airdrops：第一批時建立，之後每批在同一個交易裡累加 credited，
+    中途失敗時 credited 就是實際已入帳的人數。
+    progress(done, total) 在每批 commit 後呼叫。回傳入帳人數。
+    """
+    if amount <= 0:
+        raise ValueError(f"空投金額必須是正數：{amount}")
+    user_ids = list(dict.fromkeys(user_ids))
+    total = len(user_ids)
+    if not total:
+        return 0
+
+    airdrop_id = None
+    for start in range(0, total, AIRDROP_CHUNK_SIZE):
+        chunk = user_ids[start:start + AIRDROP_CHUNK_SIZE]
+        async with _write() as db:
+            if airdrop_id is None:
+                cur = await db.execute("""
+                    INSERT INTO airdrops
+                    (guild_id, admin_user_id, role_id, amount, recipients, credited, created_ts)
+                    VALUES (?, ?, ?, ?, ?, 0, ?);
+                """, (guild_id, admin_user_id, role_id, amount, total, utc_now_ts()))
+                airdrop_id = cur.lastrowid
+            await db.executemany("""
+                INSERT INTO wallet (guild_id, user_id, coins)
+                VALUES (?, ?, ?)
+                ON CONFLICT(guild_id, user_id)
+                DO UPDATE SET coins = coins + excluded.coins;
+            """, [(guild_id, user_id, amount) for user_id in chunk])
+            await db.execute(
+                "UPDATE airdrops SET credited = credited + ? WHERE id=?;",
+                (len(chunk), airdrop_id)
+            )
+        _top_invalidate("coins", guild_id)
+        for user_id in chunk:
+            _invalidate_profile(guild_id, user_id)
+        if progress is not None:
+            progress(start + len(chunk), total)
+        await asyncio.sleep(0)
+    return total
 
 def xp_to_level(xp: int) -> int:
     return int((xp // 100) ** 0.5) + 1
 
 async def add_xp(guild_id, user_id, amount, cooldown_sec=60):
     now = utc_now_ts()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO levels (guild_id, user_id) VALUES (?, ?);",
-            (guild_id, user_id)
-        )
-        cur = await db.execute(
-            "SELECT xp, level, last_xp_ts FROM levels WHERE guild_id=? AND user_id=?;",
-            (guild_id, user_id)
-        )
-        xp, lvl, last = await cur.fetchone()
-        if now - last < cooldown_sec:
-            return False, xp, lvl, False
-
-        xp += amount
-        lvl2 = xp_to_level(xp)
-        leveled = lvl2 > lvl
-
-        await db.execute("""
-            UPDATE levels
-            SET xp=?, level=?, last_xp_ts=?
-            WHERE guild_id=? AND user_id=?;
-        """, (xp, lvl2, now, guild_id, user_id))
-        await db.commit()
-        return True, xp, lvl2, leveled
+    key = (guild_id, user_id)
+    if _on_cooldown(_xp_cooldowns, key, now, cooldown_sec):
+        state = _user_cache.get(key)
+        if state is not None:
+            return False, state.xp, state.level, False
+    state = await _load_user_state(guild_id, user_id)
+    result = _apply_xp(guild_id, user_id, state, now, amount, cooldown_sec)
+    if result[0]:
+        await _maybe_flush()
+    return result
+
+
+def _apply_xp(guild_id, user_id, state: _UserState, now: int, amount: int, cooldown_sec: int):
+    if now - state.last_xp_ts < cooldown_sec:
+        return False, state.xp, state.level, False
+
+    # 升級判斷直接用記憶體中的最新數值，不必等寫回
+    lvl = state.level
+    state.xp += amount
+    state.level = xp_to_level(state.xp)
+    state.last_xp_ts = now
+    _xp_cooldowns.touch((guild_id, user_id), now)
+    _top_update("levels", guild_id, (user_id, state.level, state.xp))
+    _invalidate_profile(guild_id, user_id)
+    leveled = state.level > lvl
+
+    pending = _pending_xp.setdefault((guild_id, user_id), [0, 1, 0])
+    pending[0] += amount
+    pending[1] = state.level
+    pending[2] = now
+    return True, state.xp, state.level, leveled
 
 async def get_level_info(guild_id, user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO levels (guild_id, user_id) VALUES (?, ?);",
-            (guild_id, user_id)
-        )
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        return state.xp, state.level, state.last_xp_ts
+    # 還沒拿過 XP 就沒有資料列（寫回緩衝會用 UPSERT 建立），直接回傳預設值
+    async with _read() as db:
         cur = await db.execute(
             "SELECT xp, level, last_xp_ts FROM levels WHERE guild_id=? AND user_id=?;",
             (guild_id, user_id)
         )
-        return await cur.fetchone()
+        row = await cur.fetchone()
+        if row:
+            return int(row[0]), int(row[1]), int(row[2])
+        return 0, 1, 0
 
 async def get_checkin(guild_id: int, user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO checkins (guild_id, user_id) VALUES (?, ?);",
-            (guild_id, user_id)
-        )
-        await db.commit()
-
+    # 還沒簽到過就沒有資料列，update_checkin 會用 UPSERT 建立
+    async with _read() as db:
         cur = await db.execute(
             "SELECT last_checkin_ts, streak FROM checkins WHERE guild_id=? AND user_id=?;",
             (guild_id, user_id)
@@ -281,58 +1213,86 @@ async def get_checkin(guild_id: int, user_id: int):
 
 
 async def update_checkin(guild_id, user_id, ts, streak):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def tx(db):
         await db.execute("""
-            UPDATE checkins
-            SET last_checkin_ts=?, streak=?
-            WHERE guild_id=? AND user_id=?;
-        """, (ts, streak, guild_id, user_id))
-        await db.commit()
+            INSERT INTO checkins (guild_id, user_id, last_checkin_ts, streak)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET last_checkin_ts=excluded.last_checkin_ts, streak=excluded.streak;
+        """, (guild_id, user_id, ts, streak))
+
+    await _submit(tx)
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        state.streak = streak
 
 # =====================================================
 # 轉帳
 # =====================================================
 async def can_transfer(guild_id, from_user_id, cooldown_sec=60):
     now = utc_now_ts()
-    async with aiosqlite.connect(DB_PATH) as db:
+    key = (guild_id, from_user_id)
+    remain = _transfer_cooldowns.remaining(key, now, cooldown_sec)
+    if remain is not None:
+        return remain <= 0, remain
+
+    async with _read() as db:
         cur = await db.execute("""
             SELECT created_ts FROM transfers
             WHERE guild_id=? AND from_user_id=?
             ORDER BY created_ts DESC LIMIT 1;
         """, (guild_id, from_user_id))
         row = await cur.fetchone()
-        if not row:
-            return True, 0
-        remain = cooldown_sec - (now - row[0])
-        return remain <= 0, max(0, remain)
+    if not row:
+        return True, 0
+    _transfer_cooldowns.touch(key, row[0], now)
+    remain = cooldown_sec - (now - row[0])
+    return remain <= 0, max(0, remain)
 
 async def transfer_coins(guild_id, from_user_id, to_user_id, amount, fee_rate=0.05):
     fee = max(1, int(amount * fee_rate))
     total = amount + fee
-    async with aiosqlite.connect(DB_PATH) as db:
+    now = utc_now_ts()
+
+    async def tx(db):
         cur = await db.execute(
             "SELECT coins FROM wallet WHERE guild_id=? AND user_id=?;",
             (guild_id, from_user_id)
         )
-        (coins,) = await cur.fetchone()
-        if coins < total:
-            return False, "金幣不足"
+        row = await cur.fetchone()
+        if not row or row[0] < total:
+            return None
 
         await db.execute(
             "UPDATE wallet SET coins = coins - ? WHERE guild_id=? AND user_id=?;",
             (total, guild_id, from_user_id)
         )
-        await db.execute(
-            "UPDATE wallet SET coins = coins + ? WHERE guild_id=? AND user_id=?;",
-            (amount, guild_id, to_user_id)
-        )
+        # 收款人可能還沒有錢包列：用 UPSERT，避免金額憑空消失
+        await db.execute("""
+            INSERT INTO wallet (guild_id, user_id, coins)
+            VALUES (?, ?, ?)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET coins = coins + excluded.coins;
+        """, (guild_id, to_user_id, amount))
         await db.execute("""
             INSERT INTO transfers
             (guild_id, from_user_id, to_user_id, amount, fee, created_ts)
             VALUES (?, ?, ?, ?, ?, ?);
-        """, (guild_id, from_user_id, to_user_id, amount, fee, utc_now_ts()))
-        await db.commit()
-        return True, f"已轉帳 {amount}（手續費 {fee}）"
+        """, (guild_id, from_user_id, to_user_id, amount, fee, now))
+        cur = await db.execute(
+            "SELECT user_id, coins FROM wallet WHERE guild_id=? AND user_id IN (?, ?);",
+            (guild_id, from_user_id, to_user_id)
+        )
+        return await cur.fetchall()
+
+    balances = await _submit(tx)
+    if balances is None:
+        return False, "金幣不足"
+    for row in balances:
+        _top_update("coins", guild_id, row)
+        _invalidate_profile(guild_id, row[0])
+    _transfer_cooldowns.touch((guild_id, from_user_id), now)
+    return True, f"已轉帳 {amount}（手續費 {fee}）"
 # =====================================================
 # 排行榜（給 economy.py 使用）
 # =====================================================
@@ -342,16 +1302,13 @@ async def top_coins(guild_id: int, limit: int = 10):
     取得金幣排行榜
     回傳 [(user_id, coins), ...]
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT user_id, coins
-            FROM wallet
-            WHERE guild_id=?
-            ORDER BY coins DESC, user_id ASC
-            LIMIT ?;
-        """, (guild_id, limit))
-        rows = await cur.fetchall()
-        return [(int(uid), int(coins)) for uid, coins in rows]
+    return await _cached_top("coins", guild_id, limit, """
+        SELECT user_id, coins
+        FROM wallet
+        WHERE guild_id=?
+        ORDER BY coins DESC, user_id ASC
+        LIMIT ?;
+    """)
 
 
 async def top_levels(guild_id: int, limit: int = 10):
@@ -359,81 +1316,74 @@ async def top_levels(guild_id: int, limit: int = 10):
     取得等級排行榜
     回傳 [(user_id, level, xp), ...]
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT user_id, level, xp
-            FROM levels
-            WHERE guild_id=?
-            ORDER BY level DESC, xp DESC, user_id ASC
-            LIMIT ?;
-        """, (guild_id, limit))
-        rows = await cur.fetchall()
-        return [(int(uid), int(level), int(xp)) for uid, level, xp in rows]
+    return await _cached_top("levels", guild_id, limit, """
+        SELECT user_id, level, xp
+        FROM levels
+        WHERE guild_id=?
+        ORDER BY level DESC, xp DESC, user_id ASC
+        LIMIT ?;
+    """)
 # =====================================================
 # Profile 用：取得使用者完整統計
 # =====================================================
 
 async def get_profile_data(guild_id: int, user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        # 訊息數
-        cur = await db.execute("""
-            SELECT message_count
-            FROM user_stats
-            WHERE guild_id=? AND user_id=?;
-        """, (guild_id, user_id))
-        row = await cur.fetchone()
-        message_count = int(row[0]) if row else 0
-
-        # 金幣
-        cur = await db.execute("""
-            SELECT coins
-            FROM wallet
-            WHERE guild_id=? AND user_id=?;
-        """, (guild_id, user_id))
-        row = await cur.fetchone()
-        coins = int(row[0]) if row else 0
+    """
+    /profile 用的快照：一次查詢取得訊息數、金幣、等級、XP 與佩戴稱號，
+    名次由記憶體中的訊息數分布計算。
+    回傳 {"messages", "coins", "level", "xp", "title", "rank", "total"}；
+    rank 為 None 表示還沒被列入統計。
+    """
+    key = (guild_id, user_id)
+    cached = _profile_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    async def load() -> tuple[float, dict]:
+        ranking = await _guild_ranking(guild_id)
+        async with _read() as db:
+            cur = await db.execute("""
+                SELECT s.message_count, COALESCE(w.coins, 0),
+                       COALESCE(l.level, 1), COALESCE(l.xp, 0), t.name
+                FROM (SELECT ? AS guild_id, ? AS user_id) k
+                LEFT JOIN user_stats s ON s.guild_id=k.guild_id AND s.user_id=k.user_id
+                LEFT JOIN wallet w ON w.guild_id=k.guild_id AND w.user_id=k.user_id
+                LEFT JOIN levels l ON l.guild_id=k.guild_id AND l.user_id=k.user_id
+                LEFT JOIN active_titles a ON a.guild_id=k.guild_id AND a.user_id=k.user_id
+                LEFT JOIN shop_items t ON t.guild_id=a.guild_id AND t.item_id=a.item_id;
+            """, key)
+            message_count, coins, level, xp, title = await cur.fetchone()
+
+        # 訊息數 / 等級以記憶體為準（可能還在寫入緩衝中）
+        state = _user_cache.get(key)
+        if state is not None:
+            message_count = state.message_count if state.has_stats_row else None
+            level, xp = state.level, state.xp
+
+        return time.monotonic() + PROFILE_CACHE_TTL_SEC, {
+            "messages": message_count or 0,
+            "coins": coins,
+            "level": level,
+            "xp": xp,
+            "title": title,
+            "rank": ranking.count_above(message_count) + 1 if message_count is not None else None,
+            "total": ranking.total,
+        }
 
-        # 等級 / XP
-        cur = await db.execute("""
-            SELECT level, xp
-            FROM levels
-            WHERE guild_id=? AND user_id=?;
-        """, (guild_id, user_id))
-        row = await cur.fetchone()
-        level, xp = (int(row[0]), int(row[1])) if row else (1, 0)
-
-    return {
-        "messages": message_count,
-        "coins": coins,
-        "level": level,
-        "xp": xp,
-    }
+    _, data = await _profile_cache.load(key, load)
+    return data
 # =====================================================
 # 稱號系統
 # =====================================================
 
-async def ensure_title_tables():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS active_titles (
-                guild_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                item_id TEXT NOT NULL,
-                PRIMARY KEY (guild_id, user_id)
-            );
-        """)
-        await db.commit()
-
 async def set_active_title(guild_id: int, user_id: int, item_id: str | None):
     """設定使用者目前佩戴的稱號（item_id 例如 title_001）"""
-    await ensure_title_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def tx(db):
         if item_id is None:
             await db.execute("""
                 DELETE FROM active_titles
                 WHERE guild_id=? AND user_id=?;
             """, (guild_id, user_id))
-            await db.commit()
             return
         await db.execute("""
             INSERT INTO active_titles (guild_id, user_id, item_id)
@@ -441,12 +1391,13 @@ async def set_active_title(guild_id: int, user_id: int, item_id: str | None):
             ON CONFLICT(guild_id, user_id)
             DO UPDATE SET item_id=excluded.item_id;
         """, (guild_id, user_id, item_id))
-        await db.commit()
+
+    await _submit(tx)
+    _invalidate_profile(guild_id, user_id)
 
 
 async def get_active_title_item_id(guild_id: int, user_id: int) -> str | None:
-    await ensure_title_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT item_id
             FROM active_titles
@@ -461,8 +1412,7 @@ async def get_active_title(guild_id: int, user_id: int) -> str | None:
     回傳使用者目前佩戴稱號的「名稱」(shop_items.name)；
     若找不到就回傳 None
     """
-    await ensure_title_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT s.name
             FROM active_titles a
@@ -478,15 +1428,16 @@ async def get_active_title(guild_id: int, user_id: int) -> str | None:
 async def list_owned_titles(guild_id: int, user_id: int):
     """
     從 inventory 中撈出稱號類商品（item_id 以 title_ 開頭）
+    前綴用範圍條件（'`' 是 '_' 的下一個字元），才能走 inventory 的主鍵索引
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT s.item_id, s.name
             FROM inventory i
             JOIN shop_items s
               ON s.guild_id=i.guild_id AND s.item_id=i.item_id
             WHERE i.guild_id=? AND i.user_id=? AND i.qty > 0
-              AND s.item_id LIKE 'title_%'
+              AND i.item_id >= 'title_' AND i.item_id < 'title`'
             ORDER BY s.name ASC;
         """, (guild_id, user_id))
         rows = await cur.fetchall()
@@ -494,77 +1445,78 @@ async def list_owned_titles(guild_id: int, user_id: int):
 # =====================================================
 # 商店系統
 # =====================================================
+async def _shop_catalog(guild_id: int) -> tuple[list[tuple], dict[str, tuple]]:
+    """商店目錄（快取），第一次讀取時載入"""
+    cached = _shop_catalogs.get(guild_id)
+    if cached is not None:
+        return cached
+
+    async def load():
+        async with _read() as db:
+            cur = await db.execute("""
+                SELECT item_id, name, price, description
+                FROM shop_items
+                WHERE guild_id=?
+                ORDER BY price ASC;
+            """, (guild_id,))
+            rows = [tuple(r) for r in await cur.fetchall()]
+        return rows, {r[0]: r for r in rows}
+
+    return await _shop_catalogs.load(guild_id, load)
+
+
 async def list_shop(guild_id: int):
     """
     取得商店所有商品
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT item_id, name, price, description
-            FROM shop_items
-            WHERE guild_id=?
-            ORDER BY price ASC;
-        """, (guild_id,))
-        rows = await cur.fetchall()
-        return rows
+    rows, _ = await _shop_catalog(guild_id)
+    return list(rows)
 
 
 async def buy_item(guild_id: int, user_id: int, item_id: str, qty: int = 1):
     """
-    購買商品
+    購買商品：價格查目錄快取，交易裡只有兩句寫入——
+    有條件扣款（coins >= 花費才成立）與背包 UPSERT，不必先讀餘額再寫。
+    商品只會新增、不會改價（add_shop_item 是 INSERT OR IGNORE），快取的價格不會過期。
+    qty 必須是正數（和 grant_inventory_items 一樣），否則丟 ValueError。
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        # 商品是否存在
-        cur = await db.execute("""
-            SELECT price, name
-            FROM shop_items
-            WHERE guild_id=? AND item_id=?;
-        """, (guild_id, item_id))
-        row = await cur.fetchone()
-        if not row:
-            return False, "找不到這個商品。", None
-
-        price, name = row
-        total_cost = price * qty
-
-        # 餘額是否足夠
-        cur = await db.execute("""
-            SELECT coins
-            FROM wallet
-            WHERE guild_id=? AND user_id=?;
-        """, (guild_id, user_id))
-        row = await cur.fetchone()
-        coins = row[0] if row else 0
-
-        if coins < total_cost:
-            return False, "金幣不足。", None
+    if qty <= 0:
+        raise ValueError(f"購買數量必須是正數：{qty}")
+    _, items = await _shop_catalog(guild_id)
+    item = items.get(item_id)
+    if item is None:
+        return False, "找不到這個商品。", None
+    name, price = item[1], item[2]
+    total_cost = price * qty
+
+    async def tx(db):
+        coins = None
+        if total_cost > 0:
+            cur = await db.execute("""
+                UPDATE wallet
+                SET coins = coins - ?
+                WHERE guild_id=? AND user_id=? AND coins >= ?
+                RETURNING coins;
+            """, (total_cost, guild_id, user_id, total_cost))
+            row = await cur.fetchone()
+            if row is None:
+                return False, None
+            coins = row[0]
 
-        # 扣錢
         await db.execute("""
-            INSERT OR IGNORE INTO wallet (guild_id, user_id, coins)
-            VALUES (?, ?, 0);
-        """, (guild_id, user_id))
-
-        await db.execute("""
-            UPDATE wallet
-            SET coins = coins - ?
-            WHERE guild_id=? AND user_id=?;
-        """, (total_cost, guild_id, user_id))
-
-        # 加進背包
-        await db.execute("""
-            INSERT OR IGNORE INTO inventory (guild_id, user_id, item_id, qty)
-            VALUES (?, ?, ?, 0);
-        """, (guild_id, user_id, item_id))
-
-        await db.execute("""
-            UPDATE inventory
-            SET qty = qty + ?
-            WHERE guild_id=? AND user_id=? AND item_id=?;
-        """, (qty, guild_id, user_id, item_id))
-
-        await db.commit()
-
+            INSERT INTO inventory (guild_id, user_id, item_id, qty)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id, item_id)
+            DO UPDATE SET qty = qty + excluded.qty;
+        """, (guild_id, user_id, item_id, qty))
+        return True, coins
+
+    ok, coins = await _submit(tx)
+    if not ok:
+        return False, "金幣不足。", None
+    if coins is not None:
+        _top_update("coins", guild_id, (user_id, coins))
+    _invalidate_profile(guild_id, user_id)
     return True, f"成功購買 {name} × {qty}", name
 
 
@@ -572,7 +1524,7 @@ async def list_inventory(guild_id: int, user_id: int):
     """
     查看使用者背包
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT i.item_id, i.qty, s.name
             FROM inventory i
@@ -590,42 +1542,61 @@ async def add_shop_item(
     price: int,
     description: str
 ):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("""
             INSERT OR IGNORE INTO shop_items
             (guild_id, item_id, name, price, description)
             VALUES (?, ?, ?, ?, ?);
         """, (guild_id, item_id, name, price, description))
-        await db.commit()
+    _shop_catalogs.invalidate(guild_id)
+
+
+def catalog_hash(items: Iterable[tuple]) -> str:
+    """商品目錄的雜湊值（與順序無關）"""
+    payload = json.dumps(sorted(list(item) for item in items), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def seed_shop_catalog(guild_ids: Iterable[int], items: list[tuple]) -> int:
+    """
+    把預設商品 [(item_id, name, price, description), ...] 寫進每個伺服器的商店。
+    已寫過同一版目錄的伺服器直接跳過；其餘伺服器在同一個交易裡用 executemany 寫入
+    （INSERT OR IGNORE，和 add_shop_item 一樣不覆蓋已存在的商品）。
+    回傳這次實際寫入的伺服器數。
+    """
+    digest = catalog_hash(items)
+    guild_ids = list(dict.fromkeys(guild_ids))
+    if not guild_ids:
+        return 0
+
+    async with _read() as db:
+        cur = await db.execute("""
+            SELECT guild_id FROM shop_catalog_seeds
+            WHERE guild_id IN (SELECT value FROM json_each(?)) AND catalog_hash=?;
+        """, (json.dumps(guild_ids), digest))
+        seeded = {row[0] for row in await cur.fetchall()}
+    stale = [gid for gid in guild_ids if gid not in seeded]
+    if not stale:
+        return 0
+
+    async with _write() as db:
+        await db.executemany("""
+            INSERT OR IGNORE INTO shop_items
+            (guild_id, item_id, name, price, description)
+            VALUES (?, ?, ?, ?, ?);
+        """, [(gid, *item) for gid in stale for item in items])
+        await db.executemany("""
+            INSERT INTO shop_catalog_seeds (guild_id, catalog_hash)
+            VALUES (?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET catalog_hash=excluded.catalog_hash;
+        """, [(gid, digest) for gid in stale])
+    for gid in stale:
+        _shop_catalogs.invalidate(gid)
+    return len(stale)
 # =========================
 # 成就系統（Achievements）
 # =========================
 
-async def ensure_achievement_tables():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS achievements (
-                guild_id INTEGER NOT NULL,
-                code TEXT NOT NULL,
-                name TEXT NOT NULL,
-                description TEXT NOT NULL,
-                reward_item_id TEXT,
-                created_ts INTEGER NOT NULL,
-                PRIMARY KEY (guild_id, code)
-            );
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS user_achievements (
-                guild_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                code TEXT NOT NULL,
-                unlocked_ts INTEGER NOT NULL,
-                PRIMARY KEY (guild_id, user_id, code)
-            );
-        """)
-        await db.commit()
-
-
 async def upsert_achievement(
     guild_id: int,
     code: str,
@@ -633,19 +1604,16 @@ async def upsert_achievement(
     description: str,
     reward_item_id: str | None = None,
 ):
-    await ensure_achievement_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("""
             INSERT OR REPLACE INTO achievements
             (guild_id, code, name, description, reward_item_id, created_ts)
             VALUES (?, ?, ?, ?, ?, ?);
         """, (guild_id, code, name, description, reward_item_id, int(time.time())))
-        await db.commit()
 
 
 async def has_achievement(guild_id: int, user_id: int, code: str) -> bool:
-    await ensure_achievement_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT 1 FROM user_achievements
             WHERE guild_id=? AND user_id=? AND code=?;
@@ -655,36 +1623,60 @@ async def has_achievement(guild_id: int, user_id: int, code: str) -> bool:
 
 
 async def grant_inventory_item(guild_id: int, user_id: int, item_id: str, qty: int = 1):
-    # 確保 inventory 表存在（你 init_db 已建，但這裡再保底也可）
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS inventory (
-                guild_id INTEGER,
-                user_id INTEGER,
-                item_id TEXT,
-                qty INTEGER DEFAULT 0,
-                PRIMARY KEY (guild_id, user_id, item_id)
-            );
-        """)
+    async def tx(db):
         await db.execute("""
-            INSERT OR IGNORE INTO inventory (guild_id, user_id, item_id, qty)
-            VALUES (?, ?, ?, 0);
-        """, (guild_id, user_id, item_id))
-        await db.execute("""
-            UPDATE inventory
-            SET qty = qty + ?
-            WHERE guild_id=? AND user_id=? AND item_id=?;
-        """, (qty, guild_id, user_id, item_id))
-        await db.commit()
+            INSERT INTO inventory (guild_id, user_id, item_id, qty)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id, item_id)
+            DO UPDATE SET qty = qty + excluded.qty;
+        """, (guild_id, user_id, item_id, qty))
+
+    await _submit(tx)
+
+
+async def grant_inventory_items(
+    guild_id: int,
+    grants: Iterable[tuple[int, str, int]],
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """
+    批次發放道具（活動獎勵）：grants 為 [(user_id, item_id, qty), ...]。
+    同一人同一道具先合併數量，再於單一交易裡分批 executemany UPSERT，
+    全部成功才 commit，中途失敗就整批 rollback。
+    progress(done, total) 在每批寫完後呼叫（done / total 為合併後的筆數）；
+    它在持有寫入鎖時執行，必須是同步且不阻塞的函式（例如只更新一個變數）。
+    回傳合併後實際寫入的筆數。
+    """
+    merged: dict[tuple[int, str], int] = {}
+    for user_id, item_id, qty in grants:
+        if qty <= 0:
+            raise ValueError(f"發放數量必須是正數：{(user_id, item_id, qty)}")
+        merged[(user_id, item_id)] = merged.get((user_id, item_id), 0) + qty
+    rows = [(guild_id, user_id, item_id, qty) for (user_id, item_id), qty in merged.items()]
+    total = len(rows)
+    if not total:
+        return 0
+
+    async with _write() as db:
+        for start in range(0, total, GRANT_CHUNK_SIZE):
+            await db.executemany("""
+                INSERT INTO inventory (guild_id, user_id, item_id, qty)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, user_id, item_id)
+                DO UPDATE SET qty = qty + excluded.qty;
+            """, rows[start:start + GRANT_CHUNK_SIZE])
+            if progress is not None:
+                progress(min(start + GRANT_CHUNK_SIZE, total), total)
+    return total
 
 
 async def unlock_achievement(guild_id: int, user_id: int, code: str):
     """
-    解鎖成就（只會成功一次）。回傳 (unlocked: bool, achievement_row)
+    解鎖成就（只會成功一次），獎勵與稱號自動佩戴在同一個交易寫入。
+    回傳 (unlocked: bool, achievement_row)
     achievement_row: (code, name, description, reward_item_id)
     """
-    await ensure_achievement_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         # 先取成就定義
         cur = await db.execute("""
             SELECT code, name, description, reward_item_id
@@ -694,33 +1686,54 @@ async def unlock_achievement(guild_id: int, user_id: int, code: str):
         ach = await cur.fetchone()
         if not ach:
             return False, None
+        ach = tuple(ach)
+        unlocked = await _record_unlock(db, guild_id, user_id, ach, int(time.time()))
+    _unlocked_cached(guild_id, user_id, [code])
+    return unlocked, ach
 
-        # 是否已解鎖
-        cur = await db.execute("""
-            SELECT 1 FROM user_achievements
-            WHERE guild_id=? AND user_id=? AND code=?;
-        """, (guild_id, user_id, code))
-        exists = await cur.fetchone()
-        if exists:
-            return False, ach
 
+async def _record_unlock(db, guild_id: int, user_id: int, ach: tuple, now: int) -> bool:
+    """
+    在呼叫端的寫入交易裡記一筆成就解鎖；已解鎖過就什麼都不做、回傳 False。
+    有獎勵就放進背包，稱號道具（title_ 開頭）自動佩戴。
+    unlock_achievement 與訊息流程（_apply_unlocks）共用，解鎖規則只寫在這裡。
+    """
+    code, _, _, reward_item_id = ach
+    cur = await db.execute("""
+        INSERT OR IGNORE INTO user_achievements (guild_id, user_id, code, unlocked_ts)
+        VALUES (?, ?, ?, ?);
+    """, (guild_id, user_id, code, now))
+    if cur.rowcount != 1:
+        return False
+    if not reward_item_id:
+        return True
+
+    await db.execute("""
+        INSERT INTO inventory (guild_id, user_id, item_id, qty)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT(guild_id, user_id, item_id)
+        DO UPDATE SET qty = qty + 1;
+    """, (guild_id, user_id, reward_item_id))
+    if reward_item_id.startswith("title_"):
         await db.execute("""
-            INSERT INTO user_achievements (guild_id, user_id, code, unlocked_ts)
-            VALUES (?, ?, ?, ?);
-        """, (guild_id, user_id, code, int(time.time())))
-        await db.commit()
+            INSERT INTO active_titles (guild_id, user_id, item_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET item_id=excluded.item_id;
+        """, (guild_id, user_id, reward_item_id))
+    return True
 
-    # 發放獎勵（稱號道具等）
-    reward_item_id = ach[3]
-    if reward_item_id:
-        await grant_inventory_item(guild_id, user_id, reward_item_id, qty=1)
 
-    return True, ach
+def _unlocked_cached(guild_id: int, user_id: int, codes: Iterable[str]):
+    """解鎖 commit 之後：更新記憶體中的已解鎖集合，/profile 快照作廢（可能換了稱號）"""
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        state.unlocked.update(codes)
+    _invalidate_profile(guild_id, user_id)
 
 
 async def list_achievements(guild_id: int):
-    await ensure_achievement_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT code, name, description, reward_item_id
             FROM achievements
@@ -731,8 +1744,7 @@ async def list_achievements(guild_id: int):
 
 
 async def list_user_achievements(guild_id: int, user_id: int):
-    await ensure_achievement_tables()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("""
             SELECT ua.code, ua.unlocked_ts, a.name, a.description, a.reward_item_id
             FROM user_achievements ua
@@ -746,7 +1758,10 @@ async def list_user_achievements(guild_id: int, user_id: int):
 
 # 取得玩家目前數值（給成就判斷用）
 async def get_message_count(guild_id: int, user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        return state.message_count
+    async with _read() as db:
         cur = await db.execute("""
             SELECT message_count FROM user_stats
             WHERE guild_id=? AND user_id=?;
@@ -756,7 +1771,10 @@ async def get_message_count(guild_id: int, user_id: int) -> int:
 
 
 async def get_level(guild_id: int, user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        return state.level
+    async with _read() as db:
         cur = await db.execute("""
             SELECT level FROM levels
             WHERE guild_id=? AND user_id=?;
@@ -766,10 +1784,131 @@ async def get_level(guild_id: int, user_id: int) -> int:
 
 
 async def get_streak(guild_id: int, user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    state = _user_cache.get((guild_id, user_id))
+    if state is not None:
+        return state.streak
+    async with _read() as db:
         cur = await db.execute("""
             SELECT streak FROM checkins
             WHERE guild_id=? AND user_id=?;
         """, (guild_id, user_id))
         row = await cur.fetchone()
-        return int(row[0]) if row else 0
\ No newline at end of file
+        return int(row[0]) if row else 0
+
+
+# =========================
+# 訊息事件流程（統計 + XP + 成就）
+# =========================
+
+class AchievementRules(Protocol):
+    """
+    編譯後的成就規則（見 cogs.achievements.RuleIndex）。
+    metric：messages / level / streak；
+    回傳的成就列格式同 unlock_achievement：(code, name, description, reward_item_id)
+    """
+
+    def crossed(self, metric: str, old: int, new: int) -> list[tuple]: ...
+
+    def satisfied(self, metric: str, value: int) -> list[tuple]: ...
+
+
+@dataclass
+class MessageResult:
+    counted: bool = False
+    xp_gained: bool = False
+    message_count: int = 0
+    xp: int = 0
+    level: int = 1
+    leveled_up: bool = False
+    unlocked: list[tuple] = field(default_factory=list)
+    round_trips: int = 0
+
+
+async def process_message(
+    guild_id: int,
+    user_id: int,
+    *,
+    xp_amount: int = 15,
+    stats_cooldown: int = 30,
+    xp_cooldown: int = 60,
+    rules: AchievementRules | None = None,
+) -> MessageResult:
+    """
+    一則訊息只走一次的流程：
+    讀一次使用者狀態 → 訊息數 / XP 進寫入緩衝 → 判斷成就，
+    新解鎖的成就（含獎勵與自動佩戴）在同一個交易寫入。
+    """
+    now = utc_now_ts()
+    key = (guild_id, user_id)
+    if (_on_cooldown(_stats_cooldowns, key, now, stats_cooldown)
+            and _on_cooldown(_xp_cooldowns, key, now, xp_cooldown)):
+        # 訊息數與 XP 都在冷卻中：完全不碰資料庫
+        state = _user_cache.get(key)
+        if state is None:
+            return MessageResult()
+        return MessageResult(message_count=state.message_count, xp=state.xp, level=state.level)
+
+    counter = [0]
+    token = _round_trips.set(counter)
+    try:
+        state = await _load_user_state(guild_id, user_id)
+
+        result = MessageResult()
+        old_count, old_level = state.message_count, state.level
+        result.counted = _apply_message_count(guild_id, user_id, state, now, stats_cooldown)
+        result.xp_gained, _, _, result.leveled_up = _apply_xp(
+            guild_id, user_id, state, now, xp_amount, xp_cooldown
+        )
+        result.message_count = state.message_count
+        result.xp = state.xp
+        result.level = state.level
+
+        if rules is not None:
+            if not state.rules_checked:
+                # 第一次看到這位使用者：補檢查所有已達成的成就
+                state.rules_checked = True
+                achs = (
+                    rules.satisfied("messages", state.message_count)
+                    + rules.satisfied("level", state.level)
+                    + rules.satisfied("streak", state.streak)
+                )
+            else:
+                # 之後只看這則訊息新跨過的門檻
+                achs = (
+                    rules.crossed("messages", old_count, state.message_count)
+                    + rules.crossed("level", old_level, state.level)
+                )
+            candidates = [ach for ach in achs if ach[0] not in state.unlocked]
+            if candidates:
+                result.unlocked = await _apply_unlocks(guild_id, user_id, candidates)
+
+        await _maybe_flush()
+    finally:
+        _round_trips.reset(token)
+    result.round_trips = counter[0]
+    return result
+
+
+async def _apply_unlocks(guild_id: int, user_id: int, achs: list[tuple]) -> list[tuple]:
+    """訊息流程新達成的成就：全部在同一個交易寫入"""
+    now = int(time.time())
+    unlocked = []
+    async with _write() as db:
+        for ach in achs:
+            if await _record_unlock(db, guild_id, user_id, ach, now):
+                unlocked.append(ach)
+    _unlocked_cached(guild_id, user_id, [ach[0] for ach in achs])
+    return unlocked
+
+
+# =====================================================
+# 指標：每個公開的 async 函式都記錄耗時（/metrics）
+# =====================================================
+def _instrument():
+    for name, fn in list(globals().items()):
+        if (not name.startswith("_") and inspect.iscoroutinefunction(fn)
+                and fn.__module__ == __name__):
+            globals()[name] = metrics.timed("db", name)(fn)
+
+
+_instrument()
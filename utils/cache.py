@@ -0,0 +1,72 @@
+# utils/cache.py
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+V = TypeVar("V")
+
+
+class LoadingCache(Generic[V]):
+    """
+    以資料庫為準的記憶體快取：未命中時由呼叫端載入。
+    載入期間若同一個 key 有寫入（touch / invalidate），這次載入的結果就不放進快取——
+    查詢可能讀到寫入前的舊值，直接丟掉比猜哪一個新來得安全，下次讀取再重新載入。
+    每個 key 只在有載入進行中時記 [進行中的載入數, 寫入次數]，平常不佔記憶體。
+    max_size：最多保留幾筆，超過就從最久沒用的開始淘汰（LRU）；None 表示不限。
+    """
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, V] = OrderedDict()
+        self._loads: dict[Hashable, list[int]] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> V | None:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def touch(self, key: Hashable):
+        """key 有寫入、快取已就地更新：只讓進行中的載入作廢"""
+        entry = self._loads.get(key)
+        if entry is not None:
+            entry[1] += 1
+
+    def invalidate(self, key: Hashable):
+        """key 有寫入：丟掉快取，進行中的載入也作廢"""
+        self.touch(key)
+        self._data.pop(key, None)
+
+    def clear(self):
+        for key in list(self._loads):
+            self.touch(key)
+        self._data.clear()
+
+    async def load(self, key: Hashable, loader: Callable[[], Awaitable[V]]) -> V:
+        """
+        執行 loader() 取得最新值並回傳；載入期間沒有寫入才放進快取。
+        記號在呼叫 loader 之前就掛上，loader 裡任何 await 期間的寫入都會被看到。
+        """
+        entry = self._loads.setdefault(key, [0, 0])
+        entry[0] += 1
+        seen = entry[1]
+        try:
+            value = await loader()
+        finally:
+            entry[0] -= 1
+            if not entry[0]:
+                del self._loads[key]
+        if entry[1] == seen:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+        return value
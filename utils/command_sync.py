@@ -0,0 +1,40 @@
+# utils/command_sync.py
+from __future__ import annotations
+
+import hashlib
+import json
+
+import discord
+from discord import app_commands
+
+from db import get_meta, set_meta
+
+
+def tree_hash(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None) -> str:
+    """
+    指令樹要送給 Discord 的 payload 的雜湊值（與 tree.sync 送出的內容相同）。
+    指令依 (type, name) 排序、dict 依 key 排序，註冊順序不影響結果。
+    """
+    payload = [cmd.to_dict(tree) for cmd in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda d: (d.get("type", 1), d["name"]))
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def sync_if_changed(
+    tree: app_commands.CommandTree,
+    guild: discord.abc.Snowflake | None = None,
+    force: bool = False,
+) -> bool:
+    """
+    payload 和上次同步時一樣就跳過 tree.sync（省一次 HTTP 呼叫與同步額度）。
+    回傳是否真的同步了。
+    """
+    scope = f"guild:{guild.id}" if guild is not None else "global"
+    key = f"command_sync:{tree.client.application_id}:{scope}"
+    digest = tree_hash(tree, guild)
+    if not force and await get_meta(key) == digest:
+        return False
+    await tree.sync(guild=guild)
+    await set_meta(key, digest)
+    return True
@@ -0,0 +1,62 @@
+# utils/cooldown.py
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class CooldownTracker:
+    """
+    記憶體中的冷卻表：記住每個 key 最後一次觸發的時間。
+    - 超過 ttl_sec 的紀錄會被淘汰（冷卻早就結束了，不必再記）
+    - 最多保留 max_entries 筆，超過就從最舊的開始丟
+    - 建立滿 ttl_sec 後，表中沒有的 key 也能直接判定「不在冷卻中」
+      （這段時間內的觸發都一定記在表裡）；若曾因容量上限丟掉
+      仍在冷卻中的紀錄，則要再等一個 ttl_sec 才恢復這個保證
+    """
+
+    def __init__(self, ttl_sec: int, max_entries: int = 100_000, now: int | None = None):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._last: OrderedDict[Hashable, int] = OrderedDict()
+        now = int(time.time()) if now is None else now
+        self._authoritative_from = now + ttl_sec
+
+    def __len__(self) -> int:
+        return len(self._last)
+
+    def remaining(self, key: Hashable, now: int, cooldown_sec: int) -> int | None:
+        """
+        回傳剩餘冷卻秒數（0 = 可以觸發）；
+        無法只靠記憶體判斷時回傳 None，呼叫端要自己查資料庫。
+        """
+        if cooldown_sec > self.ttl_sec:
+            return None
+        last = self._last.get(key)
+        if last is None:
+            return 0 if now >= self._authoritative_from else None
+        return max(0, cooldown_sec - (now - last))
+
+    def touch(self, key: Hashable, ts: int, now: int | None = None):
+        """記錄一次觸發（也用來把資料庫裡的時間戳預熱進來）"""
+        now = ts if now is None else now
+        if now - ts >= self.ttl_sec:
+            return
+        self._last[key] = ts
+        self._last.move_to_end(key)
+        self._evict(now)
+
+    def forget(self, key: Hashable):
+        self._last.pop(key, None)
+
+    def _evict(self, now: int):
+        while self._last:
+            key, last = next(iter(self._last.items()))
+            expired = now - last >= self.ttl_sec
+            if not expired and len(self._last) <= self.max_entries:
+                break
+            self._last.popitem(last=False)
+            if not expired:
+                # 丟掉仍在冷卻中的紀錄：表中沒有的 key 暫時不能直接放行
+                self._authoritative_from = max(self._authoritative_from, last + self.ttl_sec)
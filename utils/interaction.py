@@ -1,9 +1,13 @@
 # utils/interaction.py
 from __future__ import annotations
 
+import time
+import asyncio
 import functools
 import discord
 
+from utils.metrics import metrics
+
 
 async def safe_defer(interaction: discord.Interaction, ephemeral: bool = True) -> bool:
     """在 3 秒內先回應，避免 10062 Unknown interaction。"""
@@ -49,9 +53,32 @@ async def reply(
         return None
 
 
+async def report_progress(
+    interaction: discord.Interaction,
+    state: list[int],
+    label: str,
+    interval_sec: float = 2.0
+):
+    """
+    長時間批次作業的進度：每隔 interval_sec 秒把 state = [done, total] 寫回原本的回覆。
+    以 asyncio.create_task 啟動，作業結束後 cancel；
+    state 由作業同步更新，打 Discord API 的是這個 task（不會卡在資料庫的寫入鎖裡）。
+    """
+    while True:
+        await asyncio.sleep(interval_sec)
+        done, total = state
+        if total:
+            try:
+                await interaction.edit_original_response(
+                    content=f"⏳ {label}… {done}/{total}（{done / total:.0%}）"
+                )
+            except discord.HTTPException:
+                pass
+
+
 def auto_defer(*, ephemeral: bool = True):
     """
-    通用裝飾器：Slash command 自動 defer。
+    通用裝飾器：Slash command 自動 defer，並記錄指令耗時（/metrics）。
     使用方式：
         @app_commands.command(...)
         @auto_defer(ephemeral=True)
@@ -72,11 +99,21 @@ def auto_defer(*, ephemeral: bool = True):
             if interaction is None:
                 return await func(*args, **kwargs)
 
-            ok = await safe_defer(interaction, ephemeral=ephemeral)
-            if not ok:
-                return None
+            command = interaction.command
+            name = command.qualified_name if command is not None else func.__name__
+            t0 = time.perf_counter()
+            # defer 失敗（interaction 已過期）或指令拋出例外都算錯誤
+            error = True
+            try:
+                ok = await safe_defer(interaction, ephemeral=ephemeral)
+                if not ok:
+                    return None
 
-            return await func(*args, **kwargs)
+                result = await func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                metrics.observe("command", name, time.perf_counter() - t0, error)
 
         return wrapper
     return decorator
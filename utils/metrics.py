@@ -0,0 +1,133 @@
+# utils/metrics.py
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+
+# 延遲分桶上界（秒），最後一桶為 +Inf
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每個序列保留最近幾筆延遲，用來算 p50 / p99
+WINDOW = 512
+
+
+class Series:
+    """單一序列（例如 command/daily、db/add_coins）的累計分桶與最近延遲"""
+    __slots__ = ("buckets", "count", "errors", "total", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.recent: deque[float] = deque(maxlen=WINDOW)
+
+    def observe(self, seconds: float, error: bool = False):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        if error:
+            self.errors += 1
+
+    def percentile(self, q: float) -> float:
+        """最近 WINDOW 筆的百分位數（秒）"""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Metrics:
+    """
+    記憶體中的延遲指標：(kind, name) -> Series。
+    kind 目前有 command（slash 指令）與 db（db.py 函式）。
+    """
+
+    def __init__(self):
+        self.series: dict[tuple[str, str], Series] = {}
+        self.started = time.time()
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False):
+        key = (kind, name)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series()
+        series.observe(seconds, error)
+
+    def timed(self, kind: str, name: str):
+        """裝飾 async 函式：記錄每次呼叫的耗時（例外也算，另計錯誤數）"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                error = True
+                try:
+                    result = await func(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    self.observe(kind, name, time.perf_counter() - t0, error)
+            return wrapper
+        return decorator
+
+    def snapshot(self, kind: str) -> list[tuple[str, Series]]:
+        """某一類的所有序列，依累計耗時由大到小"""
+        rows = [(name, s) for (k, name), s in self.series.items() if k == kind]
+        rows.sort(key=lambda r: r[1].total, reverse=True)
+        return rows
+
+    def prometheus_text(self) -> str:
+        """Prometheus text exposition 格式"""
+        lines = [
+            "# HELP bot_latency_seconds Latency of slash commands and db.py calls.",
+            "# TYPE bot_latency_seconds histogram",
+        ]
+        errors = []
+        for (kind, name), s in sorted(self.series.items()):
+            labels = f'kind="{kind}",name="{_escape(name)}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, s.buckets):
+                cumulative += n
+                lines.append(f'bot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'bot_latency_seconds_bucket{{{labels},le="+Inf"}} {s.count}')
+            lines.append(f"bot_latency_seconds_sum{{{labels}}} {s.total:.6f}")
+            lines.append(f"bot_latency_seconds_count{{{labels}}} {s.count}")
+            errors.append(f"bot_errors_total{{{labels}}} {s.errors}")
+        lines += [
+            "# HELP bot_errors_total Calls that raised an exception.",
+            "# TYPE bot_errors_total counter",
+            *errors,
+            "# HELP bot_start_time_seconds Unix time the metrics registry was created.",
+            "# TYPE bot_start_time_seconds gauge",
+            f"bot_start_time_seconds {self.started:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str | Path):
+        """寫出 Prometheus 文字檔（先寫暫存檔再換名，讀取端不會看到寫一半的內容）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(self.prometheus_text(), encoding="utf-8")
+        os.replace(tmp, path)
+
+    async def dump_loop(self, path: str | Path, interval_sec: float):
+        while True:
+            await asyncio.sleep(interval_sec)
+            try:
+                self.dump(path)
+            except OSError as e:
+                print(f"[metrics] 寫出指標失敗：{e!r}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 整個程序共用一份
+metrics = Metrics()
@@ -0,0 +1,99 @@
+# utils/ranking.py
+from __future__ import annotations
+
+from typing import Callable, Iterable
+
+
+class CountRanking:
+    """
+    以 Fenwick tree 維護「分數 -> 人數」的分布（分數為非負整數，例如訊息數）。
+    - 分數變動：O(log V)
+    - 查詢比某分數高的人數：O(log V)
+    V 為目前最大分數，超出容量時自動加倍重建。
+    """
+
+    def __init__(self, rows: Iterable[tuple[int, int]] = ()):
+        self.total = 0
+        self._counts = [0] * 1024
+        self._tree = [0] * (len(self._counts) + 1)
+        self.load(rows)
+
+    def load(self, rows: Iterable[tuple[int, int]]):
+        """加入 (分數, 人數) 分布，例如 GROUP BY 的查詢結果"""
+        for value, n in rows:
+            self.add(value, n)
+
+    def add(self, value: int, delta: int = 1):
+        if value >= len(self._counts):
+            self._grow(value)
+        self._counts[value] += delta
+        self.total += delta
+        i = value + 1
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def move(self, old: int, new: int):
+        """一個人的分數從 old 變成 new"""
+        self.add(old, -1)
+        self.add(new, 1)
+
+    def count_above(self, value: int) -> int:
+        """分數嚴格大於 value 的人數"""
+        if value < 0:
+            return self.total
+        i = min(value + 1, len(self._counts))
+        at_or_below = 0
+        tree = self._tree
+        while i > 0:
+            at_or_below += tree[i]
+            i -= i & -i
+        return self.total - at_or_below
+
+    def _grow(self, value: int):
+        size = len(self._counts)
+        while size <= value:
+            size *= 2
+        self._counts.extend([0] * (size - len(self._counts)))
+        # 用原始人數重建整棵樹（O(V)）
+        tree = [0] + self._counts
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+
+class TopK:
+    """
+    排行榜前 K 名快取。rows 的第一欄為 user_id，key(row) 越大名次越前。
+    - complete=True：伺服器全部資料都在快取裡（人數不到 capacity）
+    - 否則快取保存的是「真正的前 len(rows) 名」，有人掉出去時只會縮短，
+      不夠回答查詢時 top() 回傳 None，由呼叫端重新查詢。
+    """
+
+    def __init__(self, rows: Iterable[tuple], key: Callable[[tuple], tuple], capacity: int):
+        self.capacity = capacity
+        self._key = key
+        rows = sorted(rows, key=key, reverse=True)
+        self.complete = len(rows) < capacity
+        self._rows = rows[:capacity]
+
+    def update(self, row: tuple):
+        """某位使用者的分數變了（row 為最新值）"""
+        user_id = row[0]
+        rows = [r for r in self._rows if r[0] != user_id]
+        # 非完整快取：只有比目前最後一名還好才確定在前 K 名內
+        if self.complete or (rows and self._key(row) > self._key(rows[-1])):
+            rows.append(row)
+            rows.sort(key=self._key, reverse=True)
+            if len(rows) > self.capacity:
+                rows.pop()
+                self.complete = False
+        self._rows = rows
+
+    def top(self, limit: int) -> list[tuple] | None:
+        if not self.complete and len(self._rows) < limit:
+            return None
+        return self._rows[:limit]
@@ -0,0 +1,160 @@
+# utils/slowlog.py
+from __future__ import annotations
+
+import json
+import logging
+import re
+import sqlite3
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Iterable
+
+# 只有這些語句能 EXPLAIN QUERY PLAN（BEGIN / COMMIT / PRAGMA / CREATE 等略過）
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """壓成一行，當作彙總的 key"""
+    return _WHITESPACE.sub(" ", sql).strip().rstrip(";")
+
+
+def params_shape(params, many: bool = False) -> str:
+    """參數只記型別不記值（不把使用者資料寫進日誌）：(int, int, str)；executemany 為 N×(...)"""
+    if many:
+        rows = list(params)
+        return f"{len(rows)}×{params_shape(rows[0])}" if rows else "0×()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+
+def format_plan(rows: Iterable) -> list[str]:
+    """EXPLAIN QUERY PLAN 的 (id, parent, notused, detail) 依 parent 縮排成樹"""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def summarize(entries: Iterable[dict], limit: int = 10) -> list[dict]:
+    """
+    依 SQL 彙總慢查詢紀錄：次數、累計 / 最大耗時、呼叫來源、最近一次的查詢計畫。
+    依累計耗時由大到小。
+    """
+    groups: dict[str, dict] = {}
+    for e in entries:
+        g = groups.get(e["sql"])
+        if g is None:
+            g = groups[e["sql"]] = {
+                "sql": e["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0, "callers": set(),
+            }
+        g["count"] += 1
+        g["total_ms"] += e["ms"]
+        g["max_ms"] = max(g["max_ms"], e["ms"])
+        g["callers"].add(e["caller"])
+        g["params"] = e["params"]
+        g["plan"] = e["plan"]
+    rows = sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)[:limit]
+    for g in rows:
+        g["callers"] = sorted(g["callers"])
+    return rows
+
+
+class SlowQueryLog:
+    """
+    超過門檻的 SQL：記下語句、參數型別、耗時、呼叫來源與 EXPLAIN QUERY PLAN，
+    寫進輪替的 JSON Lines 檔（logging.handlers.RotatingFileHandler），
+    並在記憶體保留最近 keep 筆，給 /slowlog 即時彙總。
+
+    threshold_ms < 0 表示關閉。查詢計畫依 SQL 快取，同一句只 EXPLAIN 一次。
+    """
+
+    def __init__(self, threshold_ms: float, path: str | Path | None,
+                 max_bytes: int = 1_000_000, backups: int = 3, keep: int = 1000):
+        self.threshold = threshold_ms / 1000 if threshold_ms >= 0 else float("inf")
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.recent: deque[dict] = deque(maxlen=keep)
+        self._plans: dict[str, list[str]] = {}
+        self._logger: logging.Logger | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold != float("inf")
+
+    async def record(self, conn, sql: str, params, seconds: float, caller: str, many: bool = False):
+        """conn 是原始的 aiosqlite 連線：EXPLAIN 不算進 DB 往返次數"""
+        key = normalize_sql(sql)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = await self._explain(conn, sql, params, many)
+            if len(self._plans) >= 256:
+                self._plans.clear()
+            self._plans[key] = plan
+        entry = {
+            "ts": round(time.time(), 3),
+            "ms": round(seconds * 1000, 3),
+            "caller": caller,
+            "sql": key,
+            "params": params_shape(params, many),
+            "plan": plan,
+        }
+        self.recent.append(entry)
+        self._write(entry)
+
+    @staticmethod
+    async def _explain(conn, sql: str, params, many: bool) -> list[str]:
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return []
+        if many:
+            params = next(iter(params), ())
+        try:
+            cur = await conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return format_plan(await cur.fetchall())
+        except sqlite3.Error as e:
+            return [f"(無法取得查詢計畫：{e})"]
+
+    def _write(self, entry: dict):
+        if self.path is None:
+            return
+        if self._logger is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(f"slowlog.{self.path}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            self._logger = logger
+        self._logger.info(json.dumps(entry, ensure_ascii=False))
+
+    def summary(self, limit: int = 10) -> list[dict]:
+        return summarize(self.recent, limit)
+
+    def close(self):
+        if self._logger is not None:
+            for handler in list(self._logger.handlers):
+                handler.close()
+                self._logger.removeHandler(handler)
+            self._logger = None
+
+
+def read_log(path: str | Path) -> list[dict]:
+    """讀回日誌檔（含輪替出來的 .1 .2 ...），由舊到新"""
+    path = Path(path)
+    rotated = [p for p in path.parent.glob(path.name + ".*") if p.suffix[1:].isdigit()]
+    rotated.sort(key=lambda p: int(p.suffix[1:]), reverse=True)
+    entries = []
+    for f in rotated + [path]:
+        if f.exists():
+            with f.open(encoding="utf-8") as fh:
+                entries.extend(json.loads(line) for line in fh if line.strip())
+    return entries
@@ -0,0 +1,68 @@
+# utils/startup.py
+from __future__ import annotations
+
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class StartupTimeline:
+    """
+    啟動時間軸：記錄每個階段（import、init_db、各 extension、指令同步、第一次 ready）
+    的開始時間與耗時，時間都相對於建立時間軸的那一刻。
+    - phase(name)：with 區塊的起訖就是這個階段（可並行，各自計時）
+    - mark(name)：從上一個階段結束到現在算成一個階段（例如等待 gateway 連線）
+    """
+
+    def __init__(self, start: float | None = None):
+        self.start = time.perf_counter() if start is None else start
+        # (階段名稱, 開始秒數, 結束秒數)
+        self.spans: list[tuple[str, float, float]] = []
+        self._last_end = 0.0
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def phase(self, name: str):
+        begin = self._now()
+        try:
+            yield
+        finally:
+            end = self._now()
+            self.spans.append((name, begin, end))
+            self._last_end = max(self._last_end, end)
+
+    def mark(self, name: str):
+        end = self._now()
+        self.spans.append((name, self._last_end, end))
+        self._last_end = end
+
+    @property
+    def total(self) -> float:
+        return max((end for _, _, end in self.spans), default=0.0)
+
+    def report(self) -> str:
+        lines = [f"啟動時間軸（總計 {self.total * 1000:.1f} ms）"]
+        for name, begin, end in sorted(self.spans, key=lambda s: s[1]):
+            lines.append(f"  +{begin * 1000:>8.1f} ms  {(end - begin) * 1000:>8.1f} ms  {name}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": round(self.total * 1000, 3),
+            "phases": [
+                {"name": name, "start_ms": round(begin * 1000, 3), "duration_ms": round((end - begin) * 1000, 3)}
+                for name, begin, end in sorted(self.spans, key=lambda s: s[1])
+            ],
+        }
+
+    def export(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# bot.py 最先 import 這個模組，時間軸從這裡開始算
+timeline = StartupTimeline()
@@ -0,0 +1,95 @@
+# utils/storage.py
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Callable, Protocol
+
+import aiosqlite
+
+# 寫入連線建立後只設定一次的 PRAGMA
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-16000;",
+    "PRAGMA busy_timeout=5000;",
+)
+READER_PRAGMAS = (
+    "PRAGMA query_only=ON;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-8000;",
+    "PRAGMA busy_timeout=5000;",
+)
+MEMORY_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY;",
+)
+
+
+class Storage(Protocol):
+    """
+    db.py 的儲存後端：負責開連線，其餘（交易、快取、寫入佇列）都在 db.py。
+    連線要提供 aiosqlite.Connection 的 execute / executemany / commit / rollback / close，
+    SQL 使用 SQLite 語法。
+    """
+
+    name: str
+
+    async def open_writer(self) -> aiosqlite.Connection:
+        """開一條讀寫連線（整個程序只會有一條）"""
+        ...
+
+    async def open_readers(self, count: int) -> list[aiosqlite.Connection]:
+        """開 count 條唯讀連線；回傳空 list 表示讀取也共用寫入連線"""
+        ...
+
+
+class SQLiteStorage:
+    """
+    磁碟上的 SQLite（WAL）：一條寫入連線 + 唯讀快照連線池。
+    path 可以是函式，開連線時才取值（讓 db.DB_PATH 在匯入後仍可修改）。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path | Callable[[], Path]):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return Path(self._path() if callable(self._path) else self._path)
+
+    async def open_writer(self) -> aiosqlite.Connection:
+        path = self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = await aiosqlite.connect(path)
+        for pragma in SQLITE_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def open_readers(self, count: int) -> list[aiosqlite.Connection]:
+        uri = self.path.resolve().as_uri() + "?mode=ro"
+        readers = []
+        for _ in range(count):
+            conn = await aiosqlite.connect(uri, uri=True)
+            for pragma in READER_PRAGMAS:
+                await conn.execute(pragma)
+            readers.append(conn)
+        return readers
+
+
+class MemoryStorage:
+    """
+    純記憶體的 SQLite（:memory:）：不碰磁碟，給測試與效能測試用。
+    只有一條連線，讀寫共用；關閉連線後資料就消失，也不能跨程序共用。
+    """
+
+    name = "memory"
+
+    async def open_writer(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(":memory:")
+        for pragma in MEMORY_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def open_readers(self, count: int) -> list[aiosqlite.Connection]:
+        return []